@@ -1,5 +1,20 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from ads.models import Ad
 
 
-admin.site.register(Ad)
+# The admin list of the ads loads the same columns as the ad list page (see AdQuerySet.for_listing)
+class AdChangeList(ChangeList):
+    def get_queryset(self, request):
+        return super().get_queryset(request).for_listing()
+
+
+class AdAdmin(admin.ModelAdmin):
+    list_display = ('title', 'owner', 'price', 'updated_at')
+    list_select_related = ('owner',)
+
+    def get_changelist(self, request, **kwargs):
+        return AdChangeList
+
+
+admin.site.register(Ad, AdAdmin)
@@ -0,0 +1,202 @@
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers, set_response_etag
+from rest_framework import mixins, permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from home.pagination import KeysetPaginator
+
+from ads import search
+from ads.counters import change_counter
+from ads.favorites import favorite_ids, set_favorites
+from ads.models import Ad, Comment, TagCount
+from ads.serializers import AdListSerializer, AdSerializer, BulkFavoriteSerializer, CommentSerializer
+
+
+"""A JSON API for the mobile client, built with Django REST framework: https://www.django-rest-framework.org/
+    /ads/api/ads/                 the ads, newest first ('?sort=popular' for the most liked, '?search=bike' to search)
+    /ads/api/ads/<id>/            one ad, with its full text
+    /ads/api/comments/?ad=<id>    the comments of an ad
+    /ads/api/favorites/           the favorite ads of the user, POST to bulk/ to change many of them at once
+    /ads/api/tags/                the tags with the number of ads using them
+Every list accepts '?fields=' (see serializers.py) and is paginated like the web pages, with the cursors of
+home/pagination.py, so a page costs the same however far the client scrolls."""
+class KeysetPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            page_size = min(int(request.query_params.get('page_size', self.page_size)), self.max_page_size)
+        except ValueError:
+            page_size = self.page_size
+        paginator = KeysetPaginator(queryset, view.get_ordering(), max(page_size, 1))
+        self.page = paginator.page(after=request.query_params.get('after'), before=request.query_params.get('before'))
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link('after', self.page.next_cursor),
+            'previous': self._link('before', self.page.previous_cursor),
+            'results': data,
+        })
+
+    def _link(self, param, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(remove_query_param(self.request.build_absolute_uri(), 'after'), 'before')
+        return replace_query_param(url, param, cursor)
+
+
+"""The answers carry an ETag (a hash of the JSON): a client asking again with If-None-Match gets an empty
+'304 Not Modified' when nothing changed, so it does not download the same page again.
+More info: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag"""
+class ConditionalGetMixin:
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        response.render()
+        set_response_etag(response)
+        # The answer depends on the user (e.g. is_favorite)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+class IsOwnerOrReadOnly(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return request.method in permissions.SAFE_METHODS or obj.owner_id == request.user.id
+
+
+class AdViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    pagination_class = KeysetPagination
+    # The same orderings as the ad list page, each backed by an index of Ad
+    orderings = {
+        'recent': ('-updated_at', '-id'),
+        'popular': ('-favorite_count', '-id'),
+    }
+
+    # The ads of the answer the user likes, for is_favorite (see serializers.py)
+    favorites = frozenset()
+
+    def get_ordering(self):
+        return self.orderings.get(self.request.query_params.get('sort'), self.orderings['recent'])
+
+    def get_queryset(self):
+        if self.action == 'list':
+            queryset = Ad.objects.for_listing()
+        else:
+            queryset = Ad.objects.select_related('owner')
+        # Only fetch the tags if they are sent
+        fields = self.request.query_params.get('fields')
+        if not fields or 'tags' in fields.split(','):
+            queryset = queryset.prefetch_related('tags')
+        return queryset
+
+    def get_serializer_class(self):
+        return AdListSerializer if self.action == 'list' else AdSerializer
+
+    def get_serializer_context(self):
+        return dict(super().get_serializer_context(), favorites=self.favorites)
+
+    def list(self, request):
+        strval = request.query_params.get('search')
+        if strval:
+            # The best matches only, see search.py
+            ads = list(search.search(self.get_queryset(), strval, limit=KeysetPagination.page_size))
+            return Response({'next': None, 'previous': None, 'results': self._serialize(ads)})
+        ads = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self._serialize(ads))
+
+    def retrieve(self, request, pk=None):
+        ad = self.get_object()
+        return Response(self._serialize([ad])[0])
+
+    def _serialize(self, ads):
+        if self.request.user.is_authenticated:
+            self.favorites = favorite_ids(self.request.user, [ad.id for ad in ads])
+        return self.get_serializer(ads, many=True).data
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+class CommentViewSet(ConditionalGetMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                     mixins.DestroyModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+
+    def get_ordering(self):
+        return ('-updated_at', '-id')
+
+    def get_queryset(self):
+        queryset = Comment.objects.select_related('owner')
+        if self.action == 'list':
+            # Always for one ad: the index on (ad, updated_at, id) gives the comments in order
+            ad_id = self.request.query_params.get('ad')
+            if not ad_id or not ad_id.isdigit():
+                raise ValidationError({'ad': 'The id of the ad is required'})
+            queryset = queryset.filter(ad_id=ad_id)
+        return queryset
+
+    # The comment and the comment_count of the ad (see counters.py) are saved together, as in the web views
+    @transaction.atomic
+    def perform_create(self, serializer):
+        comment = serializer.save(owner=self.request.user)
+        change_counter(comment.ad_id, 'comment_count', 1)
+
+    @transaction.atomic
+    def perform_destroy(self, comment):
+        comment.delete()
+        change_counter(comment.ad_id, 'comment_count', -1)
+
+
+class FavoriteViewSet(ConditionalGetMixin, viewsets.GenericViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = AdListSerializer
+    pagination_class = KeysetPagination
+
+    def get_ordering(self):
+        return ('-id',)
+
+    def get_queryset(self):
+        return Ad.objects.for_listing().prefetch_related('tags').filter(fav__user=self.request.user)
+
+    favorites = frozenset()
+
+    def get_serializer_context(self):
+        return dict(super().get_serializer_context(), favorites=self.favorites)
+
+    def list(self, request):
+        ads = self.paginate_queryset(self.get_queryset())
+        # All of them are favorites
+        self.favorites = {ad.id for ad in ads}
+        return self.get_paginated_response(self.get_serializer(ads, many=True).data)
+
+    # POST {"add": [1, 2], "remove": [3]}, see favorites.set_favorites
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = BulkFavoriteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = set_favorites(request.user, **serializer.validated_data)
+        return Response({'added': sorted(added), 'removed': sorted(removed)})
+
+
+class TagViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    permission_classes = [permissions.AllowAny]
+    MAX_TAGS = 100
+
+    # The most used tags, from the counts kept in TagCount (see tags.py) instead of counting the tagged ads every time
+    def list(self, request):
+        counts = TagCount.objects.filter(count__gt=0).select_related('tag').order_by('-count', 'tag__name')
+        tags = [
+            {'name': row.tag.name, 'slug': row.tag.slug, 'ad_count': row.count}
+            for row in counts[:self.MAX_TAGS]
+        ]
+        return Response(tags)
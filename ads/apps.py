@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AdsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ads'
+
+    def ready(self):
+        # Connect the signal handlers
+        from ads import signals  # noqa: F401
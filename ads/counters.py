@@ -0,0 +1,48 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from ads.models import Ad, Comment, Fav
+
+
+"""Keep Ad.favorite_count and Ad.comment_count up to date. The views call change_counter() in the same transaction as the
+insert or the delete of the Fav/Comment row; reconcile() recounts from the Fav and Comment tables for when they drift apart
+(e.g. rows deleted from the admin or with queryset.delete(), or a user deleted with all their comments)."""
+def change_counter(ad_id, field, delta):
+    change_counters([ad_id], field, delta)
+
+
+def change_counters(ad_ids, field, delta):
+    """Add delta to the counter of several ads at once (e.g. after a bulk insert), in a single UPDATE."""
+    if not ad_ids:
+        return
+    ads = Ad.objects.filter(id__in=ad_ids)
+    if delta < 0:
+        # Never go below zero, even if the counter had drifted
+        ads = ads.filter(**{'%s__gte' % field: -delta})
+    ads.update(**{field: F(field) + delta})
+
+
+def _real_count(model):
+    rows = model.objects.filter(ad=OuterRef('pk')).order_by().values('ad').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(rows), 0)
+
+
+def drifted_ads():
+    """The ads whose counters do not match the Fav and Comment tables, annotated with the real counts."""
+    return Ad.objects.annotate(
+        real_favorite_count=_real_count(Fav),
+        real_comment_count=_real_count(Comment),
+    ).filter(
+        ~Q(favorite_count=F('real_favorite_count')) | ~Q(comment_count=F('real_comment_count'))
+    )
+
+
+def reconcile():
+    """Fix the counters of the drifted ads and return how many there were."""
+    ids = list(drifted_ads().values_list('id', flat=True))
+    if ids:
+        Ad.objects.filter(id__in=ids).update(
+            favorite_count=_real_count(Fav),
+            comment_count=_real_count(Comment),
+        )
+    return len(ids)
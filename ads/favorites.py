@@ -0,0 +1,110 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from ads.counters import change_counter, change_counters
+from ads.models import Ad, Fav
+
+
+"""The ad list shows a star on the ads the user likes. Instead of loading every favorite of the user on each request, we only
+ask about the ads on the page, and remember the answers in Django's cache framework: one small entry per (user, ad), set to
+1 or 0. The favorite views update the entry when a star is clicked, so the cache never has to be thrown away.
+More info on the cache framework: https://docs.djangoproject.com/en/3.2/topics/cache/#the-low-level-cache-api"""
+FAVORITE_TIMEOUT = 24 * 60 * 60
+
+
+def _key(user_id, ad_id):
+    return 'ads:fav:%d:%d' % (user_id, ad_id)
+
+
+def favorite_ids(user, ad_ids):
+    """Return the set of the ads in ad_ids that user has marked as favorite."""
+    keys = {_key(user.id, ad_id): ad_id for ad_id in ad_ids}
+    cached = cache.get_many(keys)
+    favorites = {keys[key] for key, value in cached.items() if value}
+
+    missing = [ad_id for key, ad_id in keys.items() if key not in cached]
+    if missing:
+        found = set(Fav.objects.filter(user=user, ad_id__in=missing).values_list('ad_id', flat=True))
+        # add() and not set_many(): if a star was clicked since the query, remember_favorite() already wrote the new
+        # state, which must not be overwritten with the old one
+        for ad_id in missing:
+            cache.add(_key(user.id, ad_id), int(ad_id in found), FAVORITE_TIMEOUT)
+        favorites |= found
+    return favorites
+
+
+def remember_favorite(user, ad_id, is_favorite):
+    cache.set(_key(user.id, ad_id), int(is_favorite), FAVORITE_TIMEOUT)
+
+
+"""Starring an ad is the most frequent write of the site, so it is done in a single statement: 'INSERT ... ON CONFLICT DO NOTHING'
+adds the row unless the (ad, user) pair is already there (see unique_together in Fav), and the number of inserted rows
+tells us whether it was new. MySQL spells it 'INSERT IGNORE'.
+More info: https://www.sqlite.org/lang_upsert.html"""
+def add_favorite(user, ad_id):
+    """Mark ad_id as a favorite of user. Returns True if it was not one already."""
+    table = connection.ops.quote_name(Fav._meta.db_table)
+    if connection.vendor == 'mysql':
+        sql = 'INSERT IGNORE INTO %s (ad_id, user_id) VALUES (%%s, %%s)' % table
+    else:
+        sql = 'INSERT INTO %s (ad_id, user_id) VALUES (%%s, %%s) ON CONFLICT DO NOTHING' % table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [ad_id, user.id])
+            added = cursor.rowcount == 1
+        if added:
+            change_counter(ad_id, 'favorite_count', 1)
+    remember_favorite(user, ad_id, True)
+    return added
+
+
+def remove_favorite(user, ad_id):
+    """Remove ad_id from the favorites of user. Returns True if it was one."""
+    with transaction.atomic():
+        deleted, _ = Fav.objects.filter(user=user, ad_id=ad_id).delete()
+        if deleted:
+            change_counter(ad_id, 'favorite_count', -1)
+    remember_favorite(user, ad_id, False)
+    return deleted > 0
+
+
+def toggle_favorite(user, ad_id, is_favorite=None):
+    """Set the favorite state of ad_id for user, or flip it if is_favorite is None, and return the new state.
+    Passing the wanted state saves a statement and makes repeated clicks harmless.
+    Raises IntegrityError if the ad does not exist."""
+    with transaction.atomic():
+        if is_favorite is None:
+            is_favorite = not remove_favorite(user, ad_id)
+            if is_favorite:
+                add_favorite(user, ad_id)
+        elif is_favorite:
+            add_favorite(user, ad_id)
+        else:
+            remove_favorite(user, ad_id)
+    return is_favorite
+
+
+"""Many stars at once (the API has a bulk endpoint for them, see api.py): a fixed number of statements whatever the number
+of ads, instead of two per ad. We look up which of the ads are already favorites, insert the missing rows with one
+multi-row INSERT (bulk_create) and delete the others with one DELETE, then fix the counters with one UPDATE each way.
+Only the user can change their own favorites, so nobody can add the same rows between the lookup and the insert
+(and if it ever happens, ignore_conflicts skips them and 'reconcile_ad_counters' fixes the count).
+More info: https://docs.djangoproject.com/en/3.2/ref/models/querysets/#bulk-create"""
+def set_favorites(user, add=(), remove=()):
+    """Add the ads in add to the favorites of user and remove the ads in remove, ignoring the ads that do not exist.
+    Returns the sets of the ads actually added and removed."""
+    add, remove = set(add), set(remove)
+    with transaction.atomic():
+        existing = set(Fav.objects.filter(user=user, ad_id__in=add | remove).values_list('ad_id', flat=True))
+        added = set(Ad.objects.filter(id__in=add - existing).values_list('id', flat=True))
+        Fav.objects.bulk_create([Fav(user=user, ad_id=ad_id) for ad_id in added], ignore_conflicts=True)
+        change_counters(added, 'favorite_count', 1)
+
+        removed = remove & existing
+        Fav.objects.filter(user=user, ad_id__in=removed).delete()
+        change_counters(removed, 'favorite_count', -1)
+
+    states = dict.fromkeys(add & (added | existing), 1)
+    states.update(dict.fromkeys(removed, 0))
+    cache.set_many({_key(user.id, ad_id): value for ad_id, value in states.items()}, FAVORITE_TIMEOUT)
+    return added, removed
@@ -1,20 +1,22 @@
 from django import forms
+from django.conf import settings
 from ads.models import Ad
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 from ads.humanize import naturalsize
+from ads.storage import get_picture_store
+from ads.uploads import StoredPicture
 
 
 """Forms are necessary when it comes to retrieve data from the user, as they allow users to post stuff
 in our website. Here we have a form that handles the creation and the update of the ads by the users."""
 class CreateForm(forms.ModelForm):
     """max_upload_limit and max_upload_limit_text check for the size of the uploaded image, which cannot be larger than 
-    the value in max_upload_limit, which corresponds to 2 megabytes (the calculation is handled in humanize.py file)."""
-    max_upload_limit = 2 * 1024 * 1024
+    the value in max_upload_limit, the ADS_PICTURE_MAX_SIZE setting (the text is handled in humanize.py file)."""
+    max_upload_limit = settings.ADS_PICTURE_MAX_SIZE
     max_upload_limit_text = naturalsize(max_upload_limit)
     
-    # Call this 'picture' so it gets copied from the form to the in-memory model
-    # It will not be the "bytes", it will be the "InMemoryUploadedFile"
-    # because we need to pull out things like content_type
+    # The model has no 'picture' field (only picture_hash), so this form field is not copied to the model:
+    # save() below puts the uploaded file in the picture store and records its hash and content_type
     picture = forms.FileField(required=False, label='File to Upload <= '+max_upload_limit_text)
     upload_field_name = 'picture'
 
@@ -22,25 +24,32 @@ class CreateForm(forms.ModelForm):
         model = Ad
         fields = ['title', 'text', 'price', 'picture', 'tags']
 
-    # Check if the size of the picture is less than the one specified (see above).
+    # Check if the size of the picture is less than the one specified (see above). A picture the upload handler found too
+    # large has no digest, as it was not kept (see uploads.py)
     def clean(self):
         cleaned_data = super().clean()
         pic = cleaned_data.get('picture')
         if pic is None:
             return
-        if len(pic) > self.max_upload_limit:
+        if pic.size > self.max_upload_limit or (isinstance(pic, StoredPicture) and pic.digest is None):
             self.add_error('picture', "File must be < "+self.max_upload_limit_text+" bytes")
 
-    # Convert uploaded File object to a picture
+    # Store the uploaded File object in the picture store. The rest of the work on it (see ads/tasks.py) is left to the
+    # view, which queues it once the ad is saved: new_picture tells it there is a new picture
     def save(self, commit=True):
         instance = super(CreateForm, self).save(commit=False)
+        self.new_picture = False
 
-        # We only need to adjust picture if it is a freshly uploaded file
-        f = instance.picture   # Make a copy
-        if isinstance(f, InMemoryUploadedFile):  # Extract data from the form to the model
-            bytearr = f.read()
+        # We only need to adjust picture if it is a freshly uploaded file. In the ad views it was already written in the
+        # picture store while it was uploaded (see uploads.py), otherwise we copy it there chunk by chunk
+        f = self.cleaned_data.get('picture')
+        if isinstance(f, StoredPicture):
+            instance.picture_hash = f.digest
+        elif isinstance(f, UploadedFile):
+            instance.picture_hash = get_picture_store().save_chunks(f.chunks())
+        if isinstance(f, UploadedFile):
             instance.content_type = f.content_type
-            instance.picture = bytearr  # Overwrite with the actual image data
+            self.new_picture = True
 
         if commit:
             instance.save()
@@ -48,6 +57,14 @@ class CreateForm(forms.ModelForm):
 
         return instance
 
+    # The columns of the ad this form changes, for save(update_fields=...). Saving the whole row would write back the counters
+    # as they were when the ad was loaded, undoing the F() updates (see counters.py) done by other requests in the meantime
+    def changed_fields(self):
+        fields = ['title', 'text', 'price', 'updated_at']
+        if self.new_picture:
+            fields += ['picture_hash', 'content_type']
+        return fields
+
 # Handle the users' comments
 class CommentForm(forms.Form):
     comment = forms.CharField(required=True, max_length=500, min_length=3, strip=True)
@@ -0,0 +1,79 @@
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_http_date_safe
+
+
+"""Helpers for the byte-range requests of stream_file. A browser (or a CDN) that already has the first part of a picture, or
+a <video>-like client that wants to seek, can ask for a slice of the file with a header like 'Range: bytes=100-199' and gets
+back a '206 Partial Content' response with only those bytes. More info:
+https://developer.mozilla.org/en-US/docs/Web/HTTP/Range_requests"""
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Return the (first, last) byte positions asked by a Range header, both included, or None if the whole file should
+    be sent. Only single ranges are supported: for anything else we fall back to the whole file, which the RFC allows.
+    Raises RangeNotSatisfiable if the range starts after the end of the file."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # A suffix range: 'bytes=-500' means the last 500 bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    if first > last:
+        if first >= size:
+            raise RangeNotSatisfiable()
+        return None
+    return first, last
+
+
+def _read_range(f, first, last):
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def partial_response(f, size, byte_range, content_type):
+    """Build the 206 response for byte_range, or the 416 one if byte_range is None (unsatisfiable)."""
+    if byte_range is None:
+        f.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    first, last = byte_range
+    response = StreamingHttpResponse(_read_range(f, first, last), status=206, content_type=content_type)
+    response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    response['Content-Length'] = str(last - first + 1)
+    return response
+
+
+def if_range_matches(request, etag, last_modified):
+    """A Range request may come with an If-Range header holding the ETag or the date of the copy the client has:
+    if the picture changed since then, the client must get the whole new file instead of a slice."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
@@ -0,0 +1,195 @@
+import json
+import math
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ads.management.commands.generate_fixtures import USERNAME_PREFIX, WORDS
+from ads.models import Ad
+
+
+"""Measure how fast the main pages answer. Each scenario sends --requests requests and reports the throughput (requests per
+second) and the 50th, 95th and 99th percentile of the latency, as JSON: save the output of two commits and compare them.
+By default the requests go through Django's test Client, in this process and one at a time: no server is needed and the
+numbers show the cost of Django and the database alone. With --url they go to a running server (e.g. gunicorn), from
+--concurrency threads, which includes the server and the network.
+The scenarios pick random ads and words from the database, so fill it first with 'python manage.py generate_fixtures'.
+More on percentiles and why the average is not enough: https://www.brendangregg.com/blog/2016-10-01/latency-heat-maps.html"""
+SCENARIOS = ('list', 'list_logged_in', 'search', 'detail', 'picture', 'favorite_toggle')
+
+
+def percentile(sorted_values, p):
+    """The nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(durations, errors, elapsed):
+    durations = sorted(durations)
+    return {
+        'requests': len(durations),
+        'errors': errors,
+        'throughput_rps': round(len(durations) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 2) if durations else None,
+        'p50_ms': round(percentile(durations, 50) * 1000, 2) if durations else None,
+        'p95_ms': round(percentile(durations, 95) * 1000, 2) if durations else None,
+        'p99_ms': round(percentile(durations, 99) * 1000, 2) if durations else None,
+    }
+
+
+class TestClientTransport:
+    """Send the requests with Django's test Client. It checks the CSRF token like the server does (the test Client skips
+    the check by default), so the POSTs carry the token of the logged in user, as the page script sends it."""
+
+    def __init__(self, user):
+        self.anonymous = Client(enforce_csrf_checks=True)
+        self.logged_in = Client(enforce_csrf_checks=True)
+        self.logged_in.force_login(user)
+        # The list page of a logged in user uses the token, so it sets the cookie
+        self.logged_in.get(reverse('ads:all'))
+        self.csrf_token = self.logged_in.cookies[settings.CSRF_COOKIE_NAME].value
+
+    def send(self, method, path, logged_in):
+        client = self.logged_in if logged_in else self.anonymous
+        if method == 'POST':
+            response = client.post(path, HTTP_X_CSRFTOKEN=self.csrf_token)
+        else:
+            response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code
+
+
+class HttpTransport:
+    """Send the requests to a running server. The logged in requests carry the cookie of a session made here, in the
+    database the server uses, and the CSRF cookie the server gives to that session; the POSTs send the token again in
+    the X-CSRFToken header, as the page script does."""
+
+    def __init__(self, base_url, user):
+        self.base_url = base_url.rstrip('/')
+        client = Client()
+        client.force_login(user)
+        session = '%s=%s' % (settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.csrf_token = self.get_csrf_token(session)
+        self.cookie = '%s; %s=%s' % (session, settings.CSRF_COOKIE_NAME, self.csrf_token)
+
+    def get_csrf_token(self, session):
+        request = urllib.request.Request(self.base_url + reverse('ads:all'), headers={'Cookie': session})
+        cookies = SimpleCookie()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            for header in response.headers.get_all('Set-Cookie') or ():
+                cookies.load(header)
+        if settings.CSRF_COOKIE_NAME not in cookies:
+            raise CommandError('The server sent no CSRF cookie, is the session in its database?')
+        return cookies[settings.CSRF_COOKIE_NAME].value
+
+    def send(self, method, path, logged_in):
+        request = urllib.request.Request(self.base_url + path, method=method, data=b'' if method == 'POST' else None)
+        if logged_in:
+            request.add_header('Cookie', self.cookie)
+        if method == 'POST':
+            request.add_header('X-CSRFToken', self.csrf_token)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the ad pages and print the throughput and the latency percentiles as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Some of %s (default: all of them)' % ', '.join(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--warmup', type=int, default=10, help='Requests per scenario not counted')
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads sending requests (only with --url)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--label', default='', help='Saved in the output, e.g. the commit')
+        parser.add_argument('--output', help='Write the JSON to this file instead of the standard output')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        rng = random.Random(options['seed'])
+        ad_ids = list(Ad.objects.values_list('id', flat=True))
+        picture_ids = list(Ad.objects.filter(picture_hash__isnull=False).values_list('id', flat=True))
+        user = get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).order_by('id').first()
+        if not ad_ids or user is None:
+            raise CommandError('No data to benchmark, run "python manage.py generate_fixtures" first')
+
+        if options['url']:
+            transport, concurrency = HttpTransport(options['url'], user), options['concurrency']
+        else:
+            transport, concurrency = TestClientTransport(user), 1
+
+        # Each scenario is a function giving the (method, path, logged_in) of a request
+        requests = {
+            'list': lambda: ('GET', reverse('ads:all'), False),
+            'list_logged_in': lambda: ('GET', reverse('ads:all'), True),
+            'search': lambda: ('GET', '%s?search=%s' % (reverse('ads:all'), rng.choice(WORDS)), True),
+            'detail': lambda: ('GET', reverse('ads:ad_detail', args=[rng.choice(ad_ids)]), False),
+            'picture': lambda: (
+                'GET', reverse('ads:ad_picture_size', args=[rng.choice(picture_ids), 'thumb']), False
+            ),
+            'favorite_toggle': lambda: ('POST', reverse('ads:ad_favorite_toggle', args=[rng.choice(ad_ids)]), True),
+        }
+        if not picture_ids:
+            requests.pop('picture')
+
+        results = {}
+        for name in options['scenarios'] or SCENARIOS:
+            if name not in requests:
+                self.stderr.write('Skipping %s: no ad has a picture' % name)
+                continue
+            batch = [requests[name]() for _ in range(options['warmup'] + options['requests'])]
+            results[name] = self.run(transport, batch[options['warmup']:], batch[:options['warmup']], concurrency)
+            self.stderr.write('%s: %s' % (name, results[name]))
+
+        report = json.dumps({
+            'label': options['label'],
+            'date': timezone.now().isoformat(),
+            'target': options['url'] or 'test client',
+            'concurrency': concurrency,
+            'ads': len(ad_ids),
+            'scenarios': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def run(self, transport, batch, warmup, concurrency):
+        for request in warmup:
+            transport.send(*request)
+
+        def timed(request):
+            start = time.perf_counter()
+            status = transport.send(*request)
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as pool:
+                outcomes = list(pool.map(timed, batch))
+        else:
+            outcomes = [timed(request) for request in batch]
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for _, status in outcomes if status >= 400)
+        return summarize([duration for duration, _ in outcomes], errors, elapsed)
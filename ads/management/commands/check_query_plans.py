@@ -0,0 +1,95 @@
+import re
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from home.pagination import KeysetPaginator
+
+from ads.models import Ad, Fav
+from ads.views import AdListView
+
+
+"""Run the views of the ads app against the current database, collect every SQL query they send and ask SQLite how it
+would execute each one (EXPLAIN QUERY PLAN). A line like 'SCAN ads_ad' means the whole table is read, which is what the
+indexes in models.py are there to avoid: the command fails if it finds one, so it can be run in CI or after a migration.
+More info: https://www.sqlite.org/eqp.html
+The views are called directly with a RequestFactory, without the middleware, so nothing is written to the database.
+The cache is replaced by a dummy one while they run: a page served from the cache (see home/cache.py) runs no query, and
+the command would report a clean plan for nothing."""
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries of the ads views and fail if one of them does a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--search', default='ad', help='The text used to exercise the search')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is only available on SQLite')
+
+        ad = Ad.objects.order_by('-updated_at', '-id').first()
+        if ad is None:
+            raise CommandError('There are no ads to exercise the views with')
+        fav = Fav.objects.select_related('user').first()
+        user = fav.user if fav else ad.owner
+
+        requests = [
+            (reverse('ads:all'), {}),
+            (reverse('ads:all'), {'search': options['search']}),
+            (reverse('ads:all'), {'sort': 'popular'}),
+            (reverse('ads:ad_detail', args=[ad.id]), {}),
+            (reverse('ads:ad_picture', args=[ad.id]), {}),
+        ]
+        paginator = KeysetPaginator(Ad.objects.all(), AdListView.ordering, AdListView.paginate_by)
+        first_page = paginator.page()
+        if first_page.has_next:
+            requests.append((reverse('ads:all'), {'after': first_page.next_cursor}))
+
+        failures = 0
+        for path, params in requests:
+            for request_user in [AnonymousUser(), user]:
+                with override_settings(CACHES=NO_CACHE):
+                    queries = self.run_view(path, params, request_user)
+                if not queries:
+                    raise CommandError('%s ran no query for %s' % (path, request_user))
+                for sql, sql_params in queries:
+                    failures += self.check_plan(path, sql, sql_params, options['verbosity'])
+        if failures:
+            raise CommandError('%d queries do a full table scan' % failures)
+        self.stdout.write(self.style.SUCCESS('No full table scans'))
+
+    def run_view(self, path, params, user):
+        """Call the view of path and return the (sql, params) of the queries it ran."""
+        queries = []
+
+        def capture(execute, sql, sql_params, many, context):
+            queries.append((sql, sql_params))
+            return execute(sql, sql_params, many, context)
+
+        request = RequestFactory().get(path, params)
+        request.user = user
+        match = resolve(path)
+        with connection.execute_wrapper(capture):
+            try:
+                match.func(request, *match.args, **match.kwargs).close()
+            except Http404:
+                pass
+        return queries
+
+    def check_plan(self, path, sql, sql_params, verbosity):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, sql_params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        scans = [line for line in plan if FULL_SCAN_RE.match(line)]
+        if scans or verbosity > 1:
+            self.stdout.write('%s\n  %s\n    %s' % (path, sql, '\n    '.join(plan)))
+        for line in scans:
+            self.stderr.write('Full table scan in %s: %s' % (path, line))
+        return len(scans)
@@ -0,0 +1,123 @@
+import io
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import Tag
+
+from home.cache import invalidate_pages
+
+from ads import counters, search, thumbnails
+from ads.models import Ad, Comment, Fav, TaggedAd
+from ads.tags import rebuild_tag_counts
+from ads.storage import get_picture_store
+
+WORDS = (
+    'bike car sofa table chair lamp phone laptop camera guitar piano book shelf desk bed mirror rug vase clock radio '
+    'red blue green black white old new vintage small large wooden metal leather cheap mint broken classic modern'
+).split()
+USERNAME_PREFIX = 'bench_user_'
+
+
+"""Fill the database with fake users, ads, pictures, comments, favorites and tags, for the benchmarks (see benchmark.py)
+or to try the site with realistic amounts of data. The rows are inserted in bulk (bulk_create), which skips save() and the
+signals, so the counters (of the ads and of the tags), the search index and the cached pages are fixed at the end. The fake users are named
+'bench_user_<n>' and --clear deletes them, with everything they own, before starting.
+The same --seed gives the same data, so two benchmark runs can be compared."""
+class Command(BaseCommand):
+    help = 'Create fake users, ads, pictures, comments, favorites and tags for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--ads', type=int, default=1000)
+        parser.add_argument('--pictures', type=int, default=20,
+                            help='Number of different pictures, shared by the ads (0 for ads without pictures)')
+        parser.add_argument('--comments', type=int, default=5, help='Average number of comments per ad')
+        parser.add_argument('--favorites', type=int, default=20, help='Number of favorites per user')
+        parser.add_argument('--tags', type=int, default=50, help='Number of different tags')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true', help='Delete the fake users made by a previous run first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        User = get_user_model()
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write('Deleted %d rows' % deleted)
+
+        with transaction.atomic():
+            # Hashing a password is slow on purpose, so all the users share the same one: 'secret'
+            password = make_password('secret')
+            first = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+            User.objects.bulk_create(
+                User(username='%s%d' % (USERNAME_PREFIX, i), password=password)
+                for i in range(first, first + options['users'])
+            )
+            user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('id', flat=True))
+
+            pictures = self.make_pictures(rng, options['pictures'])
+            # bulk_create does not give back the ids on every database, they are looked up after
+            last_id = Ad.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            ads = []
+            for i in range(options['ads']):
+                title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5)))
+                text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 200)))
+                picture_hash = rng.choice(pictures) if pictures else None
+                ads.append(Ad(
+                    title=title.capitalize(), text=text, excerpt=text[:Ad.EXCERPT_LENGTH],
+                    price=rng.randint(100, 100000) / 100, owner_id=rng.choice(user_ids),
+                    picture_hash=picture_hash, content_type='image/png' if picture_hash else None,
+                ))
+            Ad.objects.bulk_create(ads, batch_size=500)
+            ad_ids = list(Ad.objects.filter(id__gt=last_id).values_list('id', flat=True))
+
+            Comment.objects.bulk_create((
+                Comment(text=' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))),
+                        ad_id=rng.choice(ad_ids), owner_id=rng.choice(user_ids))
+                for _ in range(options['comments'] * options['ads'])
+            ), batch_size=500)
+            Fav.objects.bulk_create((
+                Fav(ad_id=ad_id, user_id=user_id)
+                for user_id in user_ids
+                for ad_id in rng.sample(ad_ids, min(options['favorites'], len(ad_ids)))
+            ), batch_size=500, ignore_conflicts=True)
+
+            self.make_tags(rng, options['tags'], ad_ids)
+            counters.reconcile()
+
+        if search.is_enabled():
+            search.rebuild_index()
+        invalidate_pages()
+        self.stdout.write(self.style.SUCCESS('Created %d users and %d ads' % (options['users'], options['ads'])))
+
+    def make_pictures(self, rng, count):
+        """Store count plain colored pictures (with their thumbnails) and return their hashes."""
+        if thumbnails.Image is None:
+            if count:
+                self.stderr.write('Pillow is not installed, the ads will have no pictures')
+            return []
+        store = get_picture_store()
+        digests = []
+        for _ in range(count):
+            image = thumbnails.Image.new('RGB', (1200, 900), tuple(rng.randrange(256) for _ in range(3)))
+            out = io.BytesIO()
+            image.save(out, 'PNG')
+            digest = store.save(out.getvalue())
+            thumbnails.make_thumbnails(digest)
+            digests.append(digest)
+        return digests
+
+    def make_tags(self, rng, count, ad_ids):
+        names = ['%s-%d' % (rng.choice(WORDS), i) for i in range(count)]
+        Tag.objects.bulk_create([Tag(name=name, slug=name) for name in names], ignore_conflicts=True)
+        tag_ids = list(Tag.objects.filter(name__in=names).values_list('id', flat=True))
+        if not tag_ids:
+            return
+        TaggedAd.objects.bulk_create((
+            TaggedAd(tag_id=tag_id, content_object_id=ad_id)
+            for ad_id in ad_ids
+            for tag_id in rng.sample(tag_ids, min(rng.randint(0, 4), len(tag_ids)))
+        ), batch_size=500, ignore_conflicts=True)
+        rebuild_tag_counts()
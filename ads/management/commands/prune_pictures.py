@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ads.models import Ad
+from ads.storage import get_picture_store
+
+
+class Command(BaseCommand):
+    help = 'Delete the pictures in the picture store that no ad uses anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the pictures that would be deleted')
+        # A picture is written to the store while it is uploaded, a moment before its ad is saved
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Keep the pictures written less than this many seconds ago')
+
+    def handle(self, *args, **options):
+        store = get_picture_store()
+        used = set(Ad.objects.filter(picture_hash__isnull=False).values_list('picture_hash', flat=True))
+        deleted = 0
+        written_before = time.time() - options['min_age']
+        for digest in list(store.digests()):
+            if digest in used or store.modified(digest) > written_before:
+                continue
+            if options['dry_run']:
+                self.stdout.write(digest)
+            else:
+                store.delete(digest)
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS('%d unused pictures' % deleted))
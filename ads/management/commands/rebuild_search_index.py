@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ads import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the ads from the ads_ad table'
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            raise CommandError('The full-text search index is only available on SQLite')
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Indexed %d ads' % count))
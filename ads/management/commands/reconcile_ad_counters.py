@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ads import counters
+from ads.tags import rebuild_tag_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount the favorites and the comments of the ads and fix the counters that drifted, then recount the tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the ads with wrong counters')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            drifted = counters.drifted_ads()
+            for ad in drifted:
+                self.stdout.write('%d: favorites %d (real %d), comments %d (real %d)' % (
+                    ad.id, ad.favorite_count, ad.real_favorite_count, ad.comment_count, ad.real_comment_count
+                ))
+            self.stdout.write(self.style.SUCCESS('%d ads with wrong counters' % len(drifted)))
+            return
+        fixed = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS('Fixed the counters of %d ads' % fixed))
+        tags = rebuild_tag_counts()
+        self.stdout.write(self.style.SUCCESS('Counted the ads of %d tags' % tags))
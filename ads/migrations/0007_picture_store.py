@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+from ads.storage import get_picture_store
+
+
+def move_pictures_to_store(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    db = schema_editor.connection.alias
+    store = get_picture_store()
+    ads = Ad.objects.using(db).filter(picture__isnull=False).only('id', 'picture')
+    for ad in ads.iterator(chunk_size=100):
+        digest = store.save(bytes(ad.picture))
+        Ad.objects.using(db).filter(id=ad.id).update(picture_hash=digest)
+
+
+def move_pictures_to_database(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    db = schema_editor.connection.alias
+    store = get_picture_store()
+    ads = Ad.objects.using(db).filter(picture_hash__isnull=False).only('id', 'picture_hash')
+    for ad in ads.iterator(chunk_size=100):
+        with store.open(ad.picture_hash) as f:
+            Ad.objects.using(db).filter(id=ad.id).update(picture=f.read())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0006_ad_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='picture_hash',
+            field=models.CharField(editable=False, help_text='The SHA-256 of the picture', max_length=64, null=True),
+        ),
+        migrations.RunPython(move_pictures_to_store, move_pictures_to_database),
+        migrations.RemoveField(
+            model_name='ad',
+            name='picture',
+        ),
+    ]
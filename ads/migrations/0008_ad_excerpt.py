@@ -0,0 +1,25 @@
+# Generated by Django 3.2.5 on 2026-10-17 02:02
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def fill_excerpts(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    Ad.objects.using(schema_editor.connection.alias).update(excerpt=Substr('text', 1, 100))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0007_picture_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
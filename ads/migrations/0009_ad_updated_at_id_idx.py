@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-17 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0008_ad_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['-updated_at', '-id'], name='ads_ad_updated_at_id_idx'),
+        ),
+    ]
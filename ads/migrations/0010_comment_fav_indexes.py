@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0009_ad_updated_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['ad', '-updated_at', '-id'], name='ads_comment_ad_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fav',
+            index=models.Index(fields=['user', 'ad'], name='ads_fav_user_ad_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.5 on 2026-10-17 02:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_rows(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+
+    def real_count(model):
+        rows = model.objects.filter(ad=OuterRef('pk')).order_by().values('ad').annotate(count=Count('*')).values('count')
+        return Coalesce(Subquery(rows), 0)
+
+    Ad.objects.using(schema_editor.connection.alias).update(
+        favorite_count=real_count(apps.get_model('ads', 'Fav')),
+        comment_count=real_count(apps.get_model('ads', 'Comment')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0010_comment_fav_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['-favorite_count', '-id'], name='ads_ad_favorite_count_id_idx'),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
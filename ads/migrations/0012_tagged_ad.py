@@ -0,0 +1,88 @@
+# Generated by Django 3.2.5 on 2026-10-17 02:26
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+import taggit.managers
+
+
+def _ad_content_type(apps, db):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    return ContentType.objects.using(db).filter(app_label='ads', model='ad').first()
+
+
+def move_tags_to_tagged_ad(apps, schema_editor):
+    db = schema_editor.connection.alias
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedAd = apps.get_model('ads', 'TaggedAd')
+    TagCount = apps.get_model('ads', 'TagCount')
+    content_type = _ad_content_type(apps, db)
+    if content_type is not None:
+        items = TaggedItem.objects.using(db).filter(content_type=content_type)
+        TaggedAd.objects.using(db).bulk_create((
+            TaggedAd(tag_id=tag_id, content_object_id=object_id)
+            for tag_id, object_id in items.values_list('tag_id', 'object_id').iterator()
+        ), batch_size=500, ignore_conflicts=True)
+        items.delete()
+    counts = TaggedAd.objects.using(db).values('tag').annotate(count=Count('*')).order_by()
+    TagCount.objects.using(db).bulk_create(
+        (TagCount(tag_id=row['tag'], count=row['count']) for row in counts.iterator()), batch_size=500
+    )
+
+
+def move_tags_to_tagged_item(apps, schema_editor):
+    db = schema_editor.connection.alias
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedAd = apps.get_model('ads', 'TaggedAd')
+    content_type = _ad_content_type(apps, db)
+    if content_type is None:
+        return
+    TaggedItem.objects.using(db).bulk_create((
+        TaggedItem(tag_id=tag_id, object_id=ad_id, content_type=content_type)
+        for tag_id, ad_id in TaggedAd.objects.using(db).values_list('tag_id', 'content_object_id').iterator()
+    ), batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('ads', '0011_ad_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ad_count', serialize=False, to='taggit.tag')),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaggedAd',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_object', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ads.ad')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ads_taggedad_items', to='taggit.tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['-count'], name='ads_tagcount_count_idx'),
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='tags',
+            field=taggit.managers.TaggableManager(blank=True, help_text='A comma-separated list of tags.', through='ads.TaggedAd', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AddIndex(
+            model_name='taggedad',
+            index=models.Index(fields=['tag', '-content_object'], name='ads_taggedad_tag_ad_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedad',
+            unique_together={('content_object', 'tag')},
+        ),
+        migrations.RunPython(move_tags_to_tagged_ad, move_tags_to_tagged_item),
+    ]
@@ -1,12 +1,29 @@
 from django.db import models
 from django.core.validators import MinLengthValidator
 from django.conf import settings
+from django.urls import reverse
 
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItemBase
+
+
+"""Ad listings (the ad list page, the admin list, the API) only show a few columns of each ad. for_listing() loads just those:
+the full text is deferred and replaced by 'excerpt', a copy of its beginning computed in Ad.save(). More info on only() and defer():
+https://docs.djangoproject.com/en/3.2/ref/models/querysets/#only
+The owner is joined in the same query (select_related), as the listings show its username: without the join every row
+would run one more query to fetch its owner."""
+class AdQuerySet(models.QuerySet):
+    LISTING_FIELDS = (
+        'id', 'title', 'excerpt', 'price', 'owner', 'content_type', 'picture_hash', 'created_at', 'updated_at',
+        'favorite_count', 'comment_count',
+    )
+
+    def for_listing(self):
+        return self.select_related('owner').only(*self.LISTING_FIELDS, 'owner__username')
 
 
 """This is the main class of the app, Ad has the fundamental fields to create an advertisement. The fields are created thanks to built-in classes
-such as TextField for a text, DecimalField for decimal numbers, BinaryField for binary files like music tracks or images. More info at:
+such as TextField for a text and DecimalField for decimal numbers. More info at:
 https://www.geeksforgeeks.org/django-model-data-types-and-fields-list/
 We also use ManyToManyField, for comments and favorites, because comments can be written by different users, so as a user can type multiple comments.
 For more info on ManyToMany: 
@@ -21,21 +38,67 @@ class Ad(models.Model) :
     )
     price = models.DecimalField(max_digits=7, decimal_places=2, null=True)
     text = models.TextField()
+    # The first EXCERPT_LENGTH characters of the text, for the listings
+    excerpt = models.CharField(max_length=100, blank=True, editable=False)
     """We use AUTH_USER_MODEL (which has a default value if it is not specified in settings.py) to create a Foreign Key relationship between the Ad model 
     and a django built-in User model"""
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     comments = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Comment', related_name='comments_owned')
-    picture = models.BinaryField(null=True, editable=True)
-    tags = TaggableManager(blank=True)
+    # The picture itself is not in the row, only the hash used to find it in the picture store (see storage.py)
+    picture_hash = models.CharField(max_length=64, null=True, editable=False, help_text='The SHA-256 of the picture')
+    tags = TaggableManager(blank=True, through='TaggedAd')
     content_type = models.CharField(max_length=256, null=True, help_text='The MIMEType of the file')
     favorites = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Fav', related_name='favorite_ads')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    """Copies of COUNT(*) over Fav and Comment, so the listings can show and sort by them without counting. They are changed
+    with F() expressions (UPDATE ... SET favorite_count = favorite_count + 1), which the database applies atomically, so two users
+    starring the same ad at the same time both get counted. 'python manage.py reconcile_ad_counters' fixes any drift.
+    More info: https://docs.djangoproject.com/en/3.2/ref/models/expressions/#f-expressions"""
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = AdQuerySet.as_manager()
+
+    EXCERPT_LENGTH = 100
+
+    # The ad list is sorted (and paginated, see home/pagination.py) by date or by popularity
+    class Meta:
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='ads_ad_updated_at_id_idx'),
+            models.Index(fields=['-favorite_count', '-id'], name='ads_ad_favorite_count_id_idx'),
+        ]
 
     # Shows up in the admin list ordered by the title
     def __str__(self):
         return self.title
 
+    # The excerpt is only computed again when the text is saved: not when it was deferred (e.g. an ad loaded by
+    # for_listing()), which would cost a query to load it, nor when update_fields leaves it out
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if 'text' not in self.get_deferred_fields() and (update_fields is None or 'text' in update_fields):
+            self.excerpt = self.text[:self.EXCERPT_LENGTH]
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'excerpt'}
+        super().save(*args, **kwargs)
+
+    """The URL of the picture carries a piece of its hash: when the picture changes so does the URL, which is what lets
+    stream_file tell browsers and CDNs to cache the picture forever."""
+    @property
+    def picture_version(self):
+        return self.picture_hash[:16] if self.picture_hash else ''
+
+    def picture_url(self):
+        return '%s?v=%s' % (reverse('ads:ad_picture', args=[self.id]), self.picture_version)
+
+    # The smaller copies of the picture, see thumbnails.py
+    def thumbnail_url(self):
+        return '%s?v=%s' % (reverse('ads:ad_picture_size', args=[self.id, 'thumb']), self.picture_version)
+
+    def medium_picture_url(self):
+        return '%s?v=%s' % (reverse('ads:ad_picture_size', args=[self.id, 'medium']), self.picture_version)
+
     
 """Take care of the comments section. Other than the text field, there is a relation with the Ad class:
 for each Ad there are different comments wrote by different users."""
@@ -50,6 +113,12 @@ class Comment(models.Model) :
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # The comments of an ad are always shown newest first: with this index the database reads them in order
+    class Meta:
+        indexes = [
+            models.Index(fields=['ad', '-updated_at', '-id'], name='ads_comment_ad_updated_idx'),
+        ]
+
     """Shows up in the admin list by name. There are two possibilities handled by an if statement:
     1. If the text length is less than 15 characters, the comment is entirely shown up in the page.
     2. Otherwise, if it is greater than 15 characters, it will print the first 11 characters plus three dots
@@ -76,6 +145,10 @@ class Fav(models.Model) :
       http://www.learningaboutelectronics.com/Articles/How-to-make-fields-of-a-database-table-unique-together-in-Django.php """
     class Meta:
         unique_together = ('ad', 'user')
+        # unique_together gives an index starting with the ad, this one serves "the favorites of a user"
+        indexes = [
+            models.Index(fields=['user', 'ad'], name='ads_fav_user_ad_idx'),
+        ]
         
     """What we have seen before but with some string formatting. Basically the '%' sign indicates
     the beginning of the specifier, while the 's' converts everything into a string 
@@ -84,3 +157,33 @@ class Fav(models.Model) :
     - https://realpython.com/python-string-formatting/#1-old-style-string-formatting-operator"""
     def __str__(self) :
         return '%s likes %s'%(self.user.username, self.ad.title[:10])
+
+
+"""The tags of the ads. By default taggit keeps the tags of every model in one "generic" table (taggit_taggeditem), where a row
+points to its object with a content type and an object id: every query has to filter on the content type, and there is
+no foreign key to join on. TaggedAd is a table for the ads only, with a real foreign key to Ad, so "the ads with this
+tag" is a plain indexed join. More info: https://django-taggit.readthedocs.io/en/latest/custom_tagging.html"""
+class TaggedAd(TaggedItemBase):
+    content_object = models.ForeignKey(Ad, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('content_object', 'tag')
+        # The ads of a tag, newest first, straight from the index (see TagAdListView)
+        indexes = [
+            models.Index(fields=['tag', '-content_object'], name='ads_taggedad_tag_ad_idx'),
+        ]
+
+
+"""How many ads use each tag, for the tag cloud. Counting them every time means going through all the tagged ads,
+so the count is kept in this table and changed when a tag is added to or removed from an ad (see tags.py)."""
+class TagCount(models.Model):
+    tag = models.OneToOneField(Tag, primary_key=True, on_delete=models.CASCADE, related_name='ad_count')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-count'], name='ads_tagcount_count_idx'),
+        ]
+
+    def __str__(self):
+        return '%s (%d)' % (self.tag.name, self.count)
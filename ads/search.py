@@ -0,0 +1,93 @@
+import re
+
+from django.db import connection, connections
+
+
+"""Full-text search for the ads. On SQLite we keep a copy of the title and the text of every ad in an FTS5 virtual table
+(created by the 0006 migration), so a search becomes an index lookup instead of a LIKE '%...%' scan of the whole ads_ad table.
+The index is kept in sync by the signals in signals.py, and it can be rebuilt from scratch with 'python manage.py rebuild_search_index'.
+For more info on FTS5: https://www.sqlite.org/fts5.html
+On other databases there is no virtual table, so we fall back to the old icontains search."""
+FTS_TABLE = 'ads_ad_fts'
+
+# The title counts ten times as much as the text when ranking the results
+TITLE_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def create_index(schema_editor):
+    # 'prefix' builds extra index entries for 2 and 3 character prefixes, which makes the "word*" queries below cheap
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+        "title, text, tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % FTS_TABLE
+    )
+
+
+def drop_index(schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+def match_expression(strval):
+    """Turn what the user typed into an FTS5 query: every word becomes a quoted prefix term (so that 'bik' finds 'bike')
+    and all the terms must match. Quoting the words means the user cannot inject FTS5 operators."""
+    terms = re.findall(r'\w+', strval)
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def index_ad(ad):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [ad.id])
+        cursor.execute(
+            'INSERT INTO %s (rowid, title, text) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+            [ad.id, ad.title, ad.text]
+        )
+
+
+def unindex_ad(ad_id):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [ad_id])
+
+
+def rebuild_index():
+    """Throw away the index and fill it again from ads_ad. Returns the number of indexed ads."""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute('INSERT INTO %s (rowid, title, text) SELECT id, title, text FROM ads_ad' % FTS_TABLE)
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+        cursor.execute('SELECT COUNT(*) FROM %s' % FTS_TABLE)
+        return cursor.fetchone()[0]
+
+
+def search_ids(strval, limit=10, using='default'):
+    """Return the ids of the ads matching strval, best match first (bm25 gives lower scores to better matches).
+    'using' is the database to ask (e.g. a replica, see home/db.py)."""
+    expression = match_expression(strval)
+    if not expression:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY bm25(%s, %%s, %%s) LIMIT %%s'
+            % (FTS_TABLE, FTS_TABLE, FTS_TABLE),
+            [expression, TITLE_WEIGHT, TEXT_WEIGHT, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(queryset, strval, limit=10):
+    """Filter queryset with the search text and return a list of at most 'limit' ads, ranked by relevance."""
+    if not is_enabled():
+        from django.db.models import Q
+        query = Q(title__icontains=strval)
+        query.add(Q(text__icontains=strval), Q.OR)
+        return list(queryset.filter(query).order_by('-updated_at')[:limit])
+
+    # The index and the ads are read from the same database: the router could send the ads to a replica that is behind
+    # the primary (or to another replica than the index)
+    using = queryset.db
+    ids = search_ids(strval, limit, using)
+    ads = queryset.using(using).in_bulk(ids)
+    return [ads[pk] for pk in ids if pk in ads]
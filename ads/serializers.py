@@ -0,0 +1,102 @@
+from rest_framework import serializers
+
+from ads.models import Ad, Comment
+
+
+"""The API (see api.py) sends ads, comments and favorites as JSON. A client can ask for only some of the fields with
+'?fields=id,title,price': SparseFieldsMixin drops the others before serializing, so the payload carries nothing the client
+does not show. More info: https://www.django-rest-framework.org/api-guide/serializers/#dynamically-modifying-fields"""
+class SparseFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        wanted = request.query_params.get('fields') if request is not None else None
+        if wanted:
+            wanted = set(wanted.split(','))
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+# The tags as a plain list of names. Read them from tags.all() so that prefetch_related('tags') is used
+class TagListField(serializers.ListField):
+    child = serializers.CharField(max_length=100)
+
+    def to_representation(self, value):
+        return [tag.name for tag in value.all()]
+
+
+"""The ads in the listings: the same columns as Ad.objects.for_listing() (the full text is not loaded, 'excerpt' is there
+instead), so serializing a page never runs a query per ad. is_favorite comes from the 'favorites' set put in the context
+by the view (see favorites.py)."""
+class AdListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    owner = serializers.CharField(source='owner.username', read_only=True)
+    tags = TagListField(required=False)
+    picture = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
+    is_favorite = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Ad
+        fields = [
+            'id', 'title', 'excerpt', 'price', 'owner', 'tags', 'picture', 'thumbnail',
+            'favorite_count', 'comment_count', 'is_favorite', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['excerpt', 'favorite_count', 'comment_count']
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_picture(self, ad):
+        return self._absolute(ad.picture_url()) if ad.picture_hash else None
+
+    def get_thumbnail(self, ad):
+        return self._absolute(ad.thumbnail_url()) if ad.picture_hash else None
+
+    def get_is_favorite(self, ad):
+        return ad.id in self.context.get('favorites', ())
+
+
+# One ad, with its full text. It is also used to create and change ads (the picture is uploaded with the web form)
+class AdSerializer(AdListSerializer):
+    class Meta(AdListSerializer.Meta):
+        fields = AdListSerializer.Meta.fields + ['text']
+
+    def create(self, validated_data):
+        tags = validated_data.pop('tags', None)
+        ad = super().create(validated_data)
+        if tags is not None:
+            ad.tags.set(*tags)
+        return ad
+
+    # Only the columns sent are written: saving the whole row would undo the F() updates of the counters (see counters.py)
+    # done since the ad was loaded
+    def update(self, instance, validated_data):
+        tags = validated_data.pop('tags', None)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        if tags is not None:
+            instance.tags.set(*tags)
+        return instance
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    owner = serializers.CharField(source='owner.username', read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'ad', 'text', 'owner', 'created_at', 'updated_at']
+
+
+# The body of the bulk favorite endpoint: the ids of the ads to star and to unstar
+class BulkFavoriteSerializer(serializers.Serializer):
+    MAX_ADS = 100
+
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=MAX_ADS)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=MAX_ADS)
+
+    def validate(self, data):
+        if set(data.get('add', ())) & set(data.get('remove', ())):
+            raise serializers.ValidationError('An ad cannot be both added and removed')
+        return data
@@ -0,0 +1,62 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from home.cache import invalidate_pages
+
+from ads import search
+from ads.models import Ad, Comment, TaggedAd
+from ads.tags import change_tag_count
+from ads.storage import get_picture_store
+
+
+# Keep the full-text search index in sync with the ads. These are connected in AdsConfig.ready() (see apps.py).
+# Note that queryset.update() and bulk_create() do not send signals: run 'python manage.py rebuild_search_index' after those.
+@receiver(post_save, sender=Ad)
+def index_ad(sender, instance, update_fields=None, **kwargs):
+    if not search.is_enabled():
+        return
+    if update_fields is not None and not {'title', 'text'} & set(update_fields):
+        return
+    search.index_ad(instance)
+
+
+@receiver(post_delete, sender=Ad)
+def unindex_ad(sender, instance, **kwargs):
+    if search.is_enabled():
+        search.unindex_ad(instance.id)
+
+
+# Pictures are shared between ads with the same content, so a file can only go once no other ad points to it.
+# Pictures left behind when an ad gets a new one are removed by 'python manage.py prune_pictures'.
+@receiver(post_delete, sender=Ad)
+def delete_unused_picture(sender, instance, **kwargs):
+    if instance.picture_hash and not Ad.objects.filter(picture_hash=instance.picture_hash).exists():
+        get_picture_store().delete(instance.picture_hash)
+
+
+# The pages cached for logged-out visitors (see home/cache.py) show the ads, their tags and their comments
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_cached_pages(sender, **kwargs):
+    invalidate_pages()
+
+
+@receiver(m2m_changed, sender=Ad.tags.through)
+def invalidate_cached_pages_on_tags(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_pages()
+
+
+# The number of ads of each tag, see tags.py. taggit creates the TaggedAd rows one by one and deletes them with a
+# queryset, which sends post_delete for each row, as does deleting an ad
+@receiver(post_save, sender=TaggedAd)
+def count_tagged_ad(sender, instance, created, **kwargs):
+    if created:
+        change_tag_count(instance.tag_id, 1)
+
+
+@receiver(post_delete, sender=TaggedAd)
+def uncount_tagged_ad(sender, instance, **kwargs):
+    change_tag_count(instance.tag_id, -1)
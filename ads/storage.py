@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+"""The pictures of the ads are not stored in the database: the ads_ad row only keeps the SHA-256 of the picture (picture_hash)
+and the picture itself lives in a "picture store". The store is content addressed, meaning that a file is named after the hash
+of its bytes: two ads with the same picture share the same file, and a file never changes once written, so it can be
+cached forever. More on content-addressable storage: https://en.wikipedia.org/wiki/Content-addressable_storage
+The store class is chosen with the ADS_PICTURE_STORAGE setting, so a different backend only needs to provide the same methods."""
+class FileSystemPictureStore:
+    """
+    Keep the pictures on disk under ADS_PICTURE_ROOT, in two levels of sub-directories taken from the
+    start of the hash (e.g. 3f/a2/3fa2...), so that no directory ends up with too many files.
+    The smaller copies made from a picture (see thumbnails.py) are stored next to it, under the key
+    '<hash>.<variant>': the methods taking a 'key' work for both.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root or settings.ADS_PICTURE_ROOT)
+
+    @staticmethod
+    def variant_key(digest, variant):
+        return '%s.%s' % (digest, variant)
+
+    def path(self, key):
+        return self.root / key[:2] / key[2:4] / key
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def open(self, key):
+        """Open the stored file for reading. Raises FileNotFoundError if there is no such picture."""
+        return open(self.path(key), 'rb')
+
+    def size(self, key):
+        return self.path(key).stat().st_size
+
+    def modified(self, key):
+        """The time the file was written, as a timestamp."""
+        return self.path(key).stat().st_mtime
+
+    def save(self, content):
+        """Store the bytes in content and return their hash."""
+        return self.save_chunks([content])
+
+    def save_chunks(self, chunks):
+        """Store the bytes of an iterable of chunks (e.g. UploadedFile.chunks()) and return their hash."""
+        writer = self.writer()
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    def writer(self):
+        return PictureWriter(self)
+
+    def put(self, key, content):
+        """Write content under key. The file is written under a temporary name and then renamed,
+        so a reader never sees a half written picture."""
+        target = self.path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(content)
+            os.chmod(tmp_name, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+            os.replace(tmp_name, target)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def delete(self, digest):
+        """Delete a picture and all its variants."""
+        path = self.path(digest)
+        for variant in path.parent.glob(self.variant_key(digest, '*')):
+            variant.unlink()
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def digests(self):
+        """Iterate over the hashes of all the stored pictures (not their variants)."""
+        if not self.root.exists():
+            return
+        for path in self.root.glob('??/??/*'):
+            if not path.name.startswith('.') and '.' not in path.name:
+                yield path.name
+
+
+"""Write a picture piece by piece, without ever holding all of it in memory: the chunks go to a temporary file in the
+store while their hash is computed, and commit() renames the file to its hash once the last chunk is in.
+The hash of a file is only known at the end, so it cannot be written to its final place directly."""
+class PictureWriter:
+    def __init__(self, store):
+        self.store = store
+        self.store.root.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_name = tempfile.mkstemp(dir=self.store.root, prefix='.upload-')
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Move the file in the store and return its hash. If the store already has it, the copy is dropped
+        ('created' tells which of the two happened)."""
+        self.file.close()
+        digest = self.hash.hexdigest()
+        target = self.store.path(digest)
+        self.created = not target.exists()
+        if not self.created:
+            os.unlink(self.tmp_name)
+            return digest
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(self.tmp_name, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(self.tmp_name, target)
+        return digest
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.tmp_name)
+        except FileNotFoundError:
+            pass
+
+
+def get_picture_store():
+    return import_string(settings.ADS_PICTURE_STORAGE)()
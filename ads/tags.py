@@ -0,0 +1,48 @@
+import math
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from ads.models import TagCount, TaggedAd
+
+
+"""Keep TagCount (see models.py) up to date. The signals (see signals.py) call change_tag_count() when a TaggedAd row is
+created or deleted: adding a tag to an ad, removing it, or deleting the ad. The count is changed with an F() expression,
+like the counters of the ads (see counters.py), so two ads tagged at the same time are both counted.
+bulk_create() and queryset.update() do not send signals: run 'python manage.py reconcile_ad_counters' after them."""
+def change_tag_count(tag_id, delta):
+    counts = TagCount.objects.filter(tag_id=tag_id)
+    if delta < 0:
+        counts.filter(count__gte=-delta).update(count=F('count') + delta)
+    elif not counts.update(count=F('count') + delta):
+        # The first ad with this tag. ignore_conflicts: another request may be creating the row at the same time
+        TagCount.objects.bulk_create([TagCount(tag_id=tag_id, count=0)], ignore_conflicts=True)
+        counts.update(count=F('count') + delta)
+
+
+def rebuild_tag_counts():
+    """Count the ads of every tag again. Returns the number of tags in use."""
+    counts = TaggedAd.objects.values('tag').annotate(count=Count('*')).order_by()
+    with transaction.atomic():
+        TagCount.objects.all().delete()
+        TagCount.objects.bulk_create(
+            (TagCount(tag_id=row['tag'], count=row['count']) for row in counts.iterator()), batch_size=500
+        )
+    return TagCount.objects.count()
+
+
+"""The tag cloud shows the most used tags, bigger the more ads use them. The sizes grow with the logarithm of the
+count, otherwise a couple of very popular tags would be huge and all the others the same small size."""
+CLOUD_SIZES = 5
+
+
+def tag_cloud(limit=100):
+    """Return the limit most used tags, sorted by name, each with its 'count' and a 'size' from 1 to CLOUD_SIZES."""
+    counts = list(TagCount.objects.filter(count__gt=0).select_related('tag').order_by('-count')[:limit])
+    if not counts:
+        return []
+    low, high = math.log(counts[-1].count), math.log(counts[0].count)
+    for tag_count in counts:
+        scale = (math.log(tag_count.count) - low) / (high - low) if high > low else 0
+        tag_count.size = 1 + round(scale * (CLOUD_SIZES - 1))
+    return sorted(counts, key=lambda tag_count: tag_count.tag.name.lower())
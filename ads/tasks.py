@@ -0,0 +1,38 @@
+from ads.models import Ad
+from ads.storage import get_picture_store
+from ads.thumbnails import Image, make_thumbnails
+from jobs.queue import task
+
+
+"""The work done on a new picture after the upload, in the job worker (see jobs/queue.py) rather than in the request:
+the browser only tells us what the file claims to be, so we look at the bytes to find its real type, then we make the
+resized copies shown by the pages (see thumbnails.py). Until this has run the pages fall back to the original picture."""
+@task
+def process_picture(ad_id):
+    ad = Ad.objects.filter(id=ad_id).only('picture_hash', 'content_type').first()
+    if ad is None or not ad.picture_hash:
+        return
+    content_type = sniff_content_type(ad.picture_hash)
+    if content_type and content_type != ad.content_type:
+        # Only if the picture was not replaced in the meantime
+        Ad.objects.filter(id=ad_id, picture_hash=ad.picture_hash).update(content_type=content_type)
+    make_thumbnails(ad.picture_hash)
+
+
+# Queued by PictureUploadMixin (see views.py) for a picture stored by a request that did not save its ad. It is left a while
+# in the store first: another upload of the same bytes may be about to save an ad pointing to it
+@task
+def delete_unused_picture(digest):
+    if not Ad.objects.filter(picture_hash=digest).exists():
+        get_picture_store().delete(digest)
+
+
+def sniff_content_type(digest):
+    """The MIME type of the picture digest according to its content, None if Pillow cannot read it."""
+    if Image is None:
+        return None
+    with get_picture_store().open(digest) as f:
+        try:
+            return Image.MIME.get(Image.open(f).format)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return None
@@ -0,0 +1,190 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from ads.favorites import add_favorite
+from ads.models import Ad, Comment, Fav
+from ads.serializers import AdSerializer
+
+
+class AdApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        cls.other = get_user_model().objects.create_user(username='other_user', password='secret')
+        Ad.objects.bulk_create(
+            Ad(title='ad %d' % i, text='text %d ' % i * 50, excerpt='text %d' % i, owner=cls.user) for i in range(25)
+        )
+        cls.ad = Ad.objects.order_by('id').first()
+        cls.ad.tags.add('bike', 'red')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_is_paginated_with_cursors(self):
+        response = self.client.get(reverse('ads:api-ad-list'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertIsNone(data['previous'])
+        self.assertNotIn('text', data['results'][0])
+
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+        self.assertEqual(len(self.client.get(data['previous']).json()['results']), 20)
+
+    def test_list_runs_a_fixed_number_of_queries(self):
+        Ad.objects.exclude(id=self.ad.id).first().tags.add('blue')
+        # ads, tags
+        with self.assertNumQueries(2):
+            self.client.get(reverse('ads:api-ad-list'))
+        self.client.force_login(self.user)
+        # session, user, ads, tags, favorites
+        with self.assertNumQueries(5):
+            self.client.get(reverse('ads:api-ad-list'))
+
+    def test_sparse_fields(self):
+        response = self.client.get(reverse('ads:api-ad-list'), {'fields': 'id,title'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+        # The tags are not sent, so not fetched either
+        with self.assertNumQueries(1):
+            self.client.get(reverse('ads:api-ad-list'), {'fields': 'id,title'})
+
+    def test_detail(self):
+        data = self.client.get(reverse('ads:api-ad-detail', args=[self.ad.id])).json()
+        self.assertEqual(data['text'], self.ad.text)
+        self.assertEqual(sorted(data['tags']), ['bike', 'red'])
+        self.assertEqual(data['owner'], 'test_user')
+
+    def test_etag(self):
+        url = reverse('ads:api-ad-detail', args=[self.ad.id])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Ad.objects.filter(id=self.ad.id).update(title='changed')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_is_favorite(self):
+        add_favorite(self.user, self.ad.id)
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('ads:api-ad-detail', args=[self.ad.id])).json()
+        self.assertTrue(data['is_favorite'])
+        self.assertEqual(data['favorite_count'], 1)
+
+    def test_create_and_update(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('ads:api-ad-list'), {'title': 'new ad', 'text': 'Ehy', 'price': '4.00', 'tags': ['car']},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        ad = Ad.objects.get(title='new ad')
+        self.assertEqual(ad.owner, self.user)
+        self.assertEqual([tag.name for tag in ad.tags.all()], ['car'])
+
+        url = reverse('ads:api-ad-detail', args=[ad.id])
+        response = self.client.patch(url, {'title': 'renamed'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(self.other)
+        response = self.client.patch(url, {'title': 'stolen'}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.client.logout()
+        response = self.client.patch(url, {'title': 'stolen'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    # A favorite added while the ad is being changed is not lost when the change is saved
+    def test_update_keeps_the_counters(self):
+        def validate(serializer, data):
+            add_favorite(self.other, self.ad.id)
+            return data
+
+        self.client.force_login(self.user)
+        with mock.patch.object(AdSerializer, 'validate', validate):
+            response = self.client.patch(
+                reverse('ads:api-ad-detail', args=[self.ad.id]), {'title': 'renamed'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.ad.refresh_from_db()
+        self.assertEqual((self.ad.title, self.ad.favorite_count), ('renamed', 1))
+
+    def test_payload_is_smaller_than_the_page(self):
+        page = self.client.get(reverse('ads:all'))
+        api = self.client.get(reverse('ads:api-ad-list'), {'fields': 'id,title,excerpt,price,thumbnail,favorite_count'})
+        self.assertLess(len(api.content), len(page.content) / 2)
+
+
+class CommentApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.ad = Ad.objects.create(title='an ad', text='Ehy', owner=self.user)
+
+    def test_comments_of_an_ad(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('ads:api-comment-list'), {'ad': self.ad.id, 'text': 'nice one'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.comment_count, 1)
+
+        data = self.client.get(reverse('ads:api-comment-list'), {'ad': self.ad.id}).json()
+        self.assertEqual([comment['text'] for comment in data['results']], ['nice one'])
+        self.assertEqual(self.client.get(reverse('ads:api-comment-list')).status_code, 400)
+
+        response = self.client.delete(reverse('ads:api-comment-detail', args=[data['results'][0]['id']]))
+        self.assertEqual(response.status_code, 204)
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.comment_count, 0)
+        self.assertFalse(Comment.objects.exists())
+
+
+class FavoriteApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.ads = [Ad.objects.create(title='ad %d' % i, text='Ehy', owner=self.user) for i in range(3)]
+        self.client.force_login(self.user)
+
+    def test_bulk(self):
+        add_favorite(self.user, self.ads[0].id)
+        url = reverse('ads:api-favorite-bulk')
+        body = {'add': [self.ads[0].id, self.ads[1].id, self.ads[2].id, 999], 'remove': []}
+        data = self.client.post(url, body, content_type='application/json').json()
+        self.assertEqual(data, {'added': [self.ads[1].id, self.ads[2].id], 'removed': []})
+        self.assertEqual(Fav.objects.filter(user=self.user).count(), 3)
+
+        data = self.client.post(url, {'remove': [self.ads[0].id, self.ads[1].id]}, content_type='application/json').json()
+        self.assertEqual(data, {'added': [], 'removed': [self.ads[0].id, self.ads[1].id]})
+        counts = dict(Ad.objects.values_list('id', 'favorite_count'))
+        self.assertEqual(counts, {self.ads[0].id: 0, self.ads[1].id: 0, self.ads[2].id: 1})
+
+        data = self.client.get(reverse('ads:api-favorite-list')).json()
+        self.assertEqual([ad['id'] for ad in data['results']], [self.ads[2].id])
+        self.assertTrue(data['results'][0]['is_favorite'])
+
+    def test_bulk_rejects_conflicting_ids(self):
+        body = {'add': [self.ads[0].id], 'remove': [self.ads[0].id]}
+        response = self.client.post(reverse('ads:api-favorite-bulk'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('ads:api-favorite-list')).status_code, 401)
+
+
+class TagApiTests(TestCase):
+    def test_tag_counts(self):
+        user = get_user_model().objects.create_user(username='test_user', password='secret')
+        for i in range(3):
+            Ad.objects.create(title='ad %d' % i, text='Ehy', owner=user).tags.add('bike', *(['red'] if i else []))
+        data = self.client.get(reverse('ads:api-tag-list')).json()
+        self.assertEqual(data, [
+            {'name': 'bike', 'slug': 'bike', 'ad_count': 3},
+            {'name': 'red', 'slug': 'red', 'ad_count': 2},
+        ])
@@ -0,0 +1,79 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from ads.management.commands.check_query_plans import FULL_SCAN_RE
+from ads.models import Ad, Comment, Fav
+
+
+class CheckQueryPlansTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        for i in range(15):
+            ad = Ad.objects.create(title='ad %d' % i, text='Ehy', owner=self.user)
+            Comment.objects.create(text='a comment', ad=ad, owner=self.user)
+        Fav.objects.create(ad=ad, user=self.user)
+
+    def test_views_do_not_scan(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out, stderr=StringIO())
+        self.assertIn('No full table scans', out.getvalue())
+
+    def test_cached_pages_are_checked_too(self):
+        # The anonymous pages are in the page cache, the command must still run (and EXPLAIN) their queries
+        ad = Ad.objects.order_by('-updated_at', '-id').first()
+        for url in [reverse('ads:all'), reverse('ads:ad_detail', args=[ad.id])]:
+            self.client.get(url)
+        out = StringIO()
+        call_command('check_query_plans', stdout=out, stderr=StringIO(), verbosity=2)
+        # The comments of the detail page, for the anonymous and the logged in user
+        self.assertEqual(out.getvalue().count('FROM "ads_comment"'), 2)
+        self.assertIn('No full table scans', out.getvalue())
+
+    def test_full_scan_detection(self):
+        self.assertTrue(FULL_SCAN_RE.match('SCAN ads_ad'))
+        self.assertTrue(FULL_SCAN_RE.match('SCAN TABLE ads_comment'))
+        self.assertFalse(FULL_SCAN_RE.match('SCAN ads_ad USING INDEX ads_ad_updated_at_id_idx'))
+        self.assertFalse(FULL_SCAN_RE.match('SCAN ads_ad_fts VIRTUAL TABLE INDEX 0:M2'))
+
+
+class BenchmarkTests(TestCase):
+    def test_generate_fixtures_and_benchmark(self):
+        picture_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, picture_root)
+        with override_settings(ADS_PICTURE_ROOT=picture_root):
+            call_command('generate_fixtures', users=3, ads=10, pictures=2, comments=2, favorites=4, tags=5,
+                         stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(get_user_model().objects.filter(username__startswith='bench_user_').count(), 3)
+            self.assertEqual(Ad.objects.count(), 10)
+            self.assertEqual(Comment.objects.count(), 20)
+            self.assertEqual(sum(Ad.objects.values_list('favorite_count', flat=True)), Fav.objects.count())
+
+            out = StringIO()
+            call_command('benchmark', requests=5, warmup=1, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {
+            'list', 'list_logged_in', 'search', 'detail', 'picture', 'favorite_toggle'
+        })
+        for result in report['scenarios'].values():
+            self.assertEqual(result['requests'], 5)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+# The benchmark against a running server, which checks the CSRF token of the POSTs
+class BenchmarkServerTests(LiveServerTestCase):
+    def test_benchmark_a_server(self):
+        call_command('generate_fixtures', users=2, ads=5, pictures=0, comments=1, favorites=2, tags=2,
+                     stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('benchmark', 'list_logged_in', 'favorite_toggle', requests=5, warmup=1, url=self.live_server_url,
+                     concurrency=1, stdout=out, stderr=StringIO())
+        for result in json.loads(out.getvalue())['scenarios'].values():
+            self.assertEqual(result['errors'], 0)
@@ -0,0 +1,60 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from ads import search
+from ads.models import Ad
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='test_user',
+            email='test@email.com',
+            password='secret'
+        )
+        self.bike = Ad.objects.create(title='Red bike', text='Almost new', owner=self.user)
+        self.lamp = Ad.objects.create(title='Desk lamp', text='Works with any bike light bulb', owner=self.user)
+        Ad.objects.create(title='Sofa', text='Blue and comfy', owner=self.user)
+
+    def test_title_matches_rank_first(self):
+        ads = search.search(Ad.objects.all(), 'bike')
+        self.assertEqual(ads, [self.bike, self.lamp])
+
+    def test_prefix_matching(self):
+        ads = search.search(Ad.objects.all(), 'bik')
+        self.assertIn(self.bike, ads)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bike.title = 'Green scooter'
+        self.bike.save()
+        self.assertEqual(search.search(Ad.objects.all(), 'scooter'), [self.bike])
+        self.bike.delete()
+        self.assertEqual(search.search(Ad.objects.all(), 'scooter'), [])
+
+    def test_operators_are_not_injected(self):
+        self.assertEqual(search.search(Ad.objects.all(), 'bike OR "sofa'), [])
+        self.assertEqual(search.search(Ad.objects.all(), '*** ""'), [])
+
+    def test_search_does_not_scan_ads_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'EXPLAIN QUERY PLAN SELECT rowid FROM ads_ad_fts WHERE ads_ad_fts MATCH %s', ['"bike"*']
+            )
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('VIRTUAL TABLE', plan)
+
+    def test_rebuild_command(self):
+        Ad.objects.filter(id=self.bike.id).update(title='Yellow kayak')  # update() bypasses the signals
+        self.assertEqual(search.search(Ad.objects.all(), 'kayak'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search.search(Ad.objects.all(), 'kayak'), [self.bike])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('ads:all'), {'search': 'lamp'})
+        self.assertContains(response, 'Desk lamp')
+        self.assertNotContains(response, 'Red bike')
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from taggit.models import Tag
+
+from ads.models import Ad, TagCount, TaggedAd
+from ads.tags import rebuild_tag_counts, tag_cloud
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='tagger', password='secret')
+        self.ads = [Ad.objects.create(title='ad %d' % i, text='Ehy', owner=self.user) for i in range(3)]
+
+    def count(self, name):
+        return TagCount.objects.filter(tag__name=name).values_list('count', flat=True).first()
+
+    def test_counts_follow_the_tags(self):
+        self.ads[0].tags.add('bike', 'red')
+        self.ads[1].tags.add('bike')
+        self.assertEqual(self.count('bike'), 2)
+        self.assertEqual(self.count('red'), 1)
+
+        # Adding a tag the ad already has does not count it twice
+        self.ads[1].tags.add('bike')
+        self.assertEqual(self.count('bike'), 2)
+
+        self.ads[0].tags.remove('bike')
+        self.assertEqual(self.count('bike'), 1)
+        self.ads[0].tags.set('blue')
+        self.assertEqual(self.count('red'), 0)
+        self.assertEqual(self.count('blue'), 1)
+
+        self.ads[1].delete()
+        self.assertEqual(self.count('bike'), 0)
+
+    def test_rebuild(self):
+        self.ads[0].tags.add('bike')
+        TaggedAd.objects.bulk_create([TaggedAd(tag=Tag.objects.get(name='bike'), content_object=self.ads[1])])
+        TagCount.objects.update(count=7)
+        self.assertEqual(rebuild_tag_counts(), 1)
+        self.assertEqual(self.count('bike'), 2)
+
+    def test_tag_cloud(self):
+        for ad in self.ads:
+            ad.tags.add('common')
+        self.ads[0].tags.add('Rare')
+        cloud = tag_cloud()
+        self.assertEqual([tag_count.tag.name for tag_count in cloud], ['common', 'Rare'])
+        self.assertEqual([tag_count.size for tag_count in cloud], [5, 1])
+        self.assertEqual(tag_cloud(limit=1)[0].size, 1)
+
+        self.ads[0].tags.remove('Rare')
+        self.assertEqual([tag_count.tag.name for tag_count in tag_cloud()], ['common'])
+
+        response = self.client.get(reverse('ads:tag_cloud'))
+        self.assertContains(response, reverse('ads:tag', args=['common']))
+
+    def test_tag_page(self):
+        for ad in self.ads:
+            ad.tags.add('bike')
+        self.ads[1].tags.add('red')
+        more = [Ad.objects.create(title='more %d' % i, text='Ehy', owner=self.user) for i in range(10)]
+        for ad in more:
+            ad.tags.add('bike')
+
+        self.client.login(username='tagger', password='secret')
+        url = reverse('ads:tag', args=['bike'])
+        # The same queries for any page size: session, user, tag, page of TaggedAd, ads, tags, favorites
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), 7)
+        # Newest first
+        self.assertEqual([ad.id for ad in response.context['ad_list']], [ad.id for ad in more[::-1]])
+        self.assertContains(response, reverse('ads:tag', args=['red']), count=0)
+
+        response = self.client.get(url, {'after': response.context['page'].next_cursor})
+        self.assertEqual([ad.id for ad in response.context['ad_list']], [ad.id for ad in self.ads[::-1]])
+        self.assertContains(response, reverse('ads:tag', args=['red']))
+        self.assertContains(response, '%s?before=' % url)
+
+        self.assertEqual(self.client.get(reverse('ads:tag', args=['nope'])).status_code, 404)
+
+        # The search box searches all the ads
+        self.assertContains(response, '<form action="%s">' % reverse('ads:all'))
+        # The main list does not show the tags
+        self.assertNotContains(self.client.get(reverse('ads:all')), reverse('ads:tag', args=['red']))
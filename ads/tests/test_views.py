@@ -1,9 +1,29 @@
+import hashlib
+import io
+import re
+import shutil
+import tempfile
+from unittest import mock, skipIf
+
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
 from django.urls import reverse
+from django.utils import timezone
 
-from ads.models import Ad
+from ads import thumbnails
+from ads.favorites import add_favorite, favorite_ids
+from ads.forms import CreateForm
+from ads.models import Ad, Comment, Fav
+from ads.storage import get_picture_store
+from home.cache import GENERATION_KEY, invalidate_pages
+from jobs.models import Job
+from jobs.queue import run_pending
 
 
 class ViewTests(TestCase):
@@ -121,3 +141,549 @@ class ViewTests(TestCase):
     def test_unfavorite_view_url_by_name(self):
         response = self.client.get(reverse('ads:ad_unfavorite', kwargs={'pk': 1}))
         self.assertEqual(response.status_code, 302)
+
+
+class PictureTests(TestCase):
+    def setUp(self):
+        picture_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, picture_root)
+        settings_override = override_settings(ADS_PICTURE_ROOT=picture_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            username='test_user',
+            email='test@email.com',
+            password='secret'
+        )
+        self.client.login(username='test_user', password='secret')
+
+    def create_ad(self, title, content):
+        picture = SimpleUploadedFile('picture.png', content, content_type='image/png')
+        self.client.post(reverse('ads:ad_create'), {'title': title, 'text': 'Ehy', 'price': 4, 'picture': picture})
+        return Ad.objects.get(title=title)
+
+    def test_picture_is_stored_outside_the_database(self):
+        self.assertNotIn('picture', [field.name for field in Ad._meta.concrete_fields])
+        ad = self.create_ad('with picture', b'fake png bytes')
+        self.assertEqual(ad.content_type, 'image/png')
+        with get_picture_store().open(ad.picture_hash) as f:
+            self.assertEqual(f.read(), b'fake png bytes')
+
+    def test_picture_is_written_to_the_store_while_uploaded(self):
+        content = b'x' * (3 * 1024 * 1024)  # more than Django keeps in memory
+        ad = self.create_ad('big picture', content)
+        self.assertEqual(get_picture_store().size(ad.picture_hash), len(content))
+        self.assertEqual(list(get_picture_store().root.glob('.upload-*')), [])
+
+    def test_too_large_picture_is_rejected(self):
+        with override_settings(ADS_PICTURE_MAX_SIZE=10):
+            picture = SimpleUploadedFile('picture.png', b'more than ten bytes', content_type='image/png')
+            response = self.client.post(reverse('ads:ad_create'), {'title': 'big', 'text': 'Ehy', 'picture': picture})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'File must be &lt;')
+        self.assertFalse(Ad.objects.filter(title='big').exists())
+        self.assertEqual(list(get_picture_store().digests()), [])
+
+    def test_upload_checks_the_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='test_user', password='secret')
+        picture = SimpleUploadedFile('picture.png', b'fake png bytes', content_type='image/png')
+        response = client.post(reverse('ads:ad_create'), {'title': 'no token', 'text': 'Ehy', 'picture': picture})
+        self.assertEqual(response.status_code, 403)
+        # With the cookie but a wrong token the body is read (to find the token) before the request is rejected
+        client.get(reverse('ads:ad_create'))
+        picture = SimpleUploadedFile('picture.png', b'fake png bytes', content_type='image/png')
+        response = client.post(
+            reverse('ads:ad_create'), {'title': 'bad token', 'text': 'Ehy', 'picture': picture, 'csrfmiddlewaretoken': 'x' * 64}
+        )
+        self.assertEqual(response.status_code, 403)
+        # The picture was written while the request was read, it does not stay in the store
+        self.run_delayed_jobs()
+        self.assertEqual(list(get_picture_store().digests()), [])
+
+    def run_delayed_jobs(self):
+        Job.objects.filter(status=Job.PENDING).update(run_after=timezone.now())
+        run_pending()
+
+    def test_picture_of_an_invalid_form_is_not_kept(self):
+        ad = self.create_ad('with picture', b'fake png bytes')
+        for content in (b'fake png bytes', b'other bytes'):
+            picture = SimpleUploadedFile('picture.png', content, content_type='image/png')
+            response = self.client.post(reverse('ads:ad_create'), {'title': 'x', 'text': 'Ehy', 'picture': picture})
+            self.assertEqual(response.status_code, 200)
+        # Only deleted a while later
+        self.assertEqual(len(list(get_picture_store().digests())), 2)
+        self.run_delayed_jobs()
+        # The picture of the saved ad is still there, even if the same bytes were sent again
+        self.assertEqual(list(get_picture_store().digests()), [ad.picture_hash])
+
+    def test_picture_shared_with_an_upload_in_progress_is_kept(self):
+        # While a request that will fail is checked, another one uploads the same bytes (sharing the file), and saves
+        # its ad once the first request is over
+        def clean(form):
+            uploads.append(get_picture_store().save_chunks([b'fake png bytes']))
+            return original_clean(form)
+
+        uploads, original_clean = [], CreateForm.clean
+        picture = SimpleUploadedFile('picture.png', b'fake png bytes', content_type='image/png')
+        with mock.patch.object(CreateForm, 'clean', clean):
+            self.client.post(reverse('ads:ad_create'), {'title': 'x', 'text': 'Ehy', 'picture': picture})
+        Ad.objects.create(title='same picture', text='Ehy', owner=self.user, picture_hash=uploads[0])
+        self.run_delayed_jobs()
+        with get_picture_store().open(uploads[0]) as f:
+            self.assertEqual(f.read(), b'fake png bytes')
+
+    def test_stream_file(self):
+        ad = self.create_ad('with picture', b'fake png bytes')
+        response = self.client.get(reverse('ads:ad_picture', kwargs={'pk': ad.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(b''.join(response.streaming_content), b'fake png bytes')
+
+    def test_stream_file_without_picture(self):
+        ad = Ad.objects.create(title='no picture', text='Ehy', owner=self.user)
+        response = self.client.get(reverse('ads:ad_picture', kwargs={'pk': ad.id}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_same_picture_is_stored_once(self):
+        first = self.create_ad('first', b'same bytes')
+        second = self.create_ad('second', b'same bytes')
+        self.assertEqual(first.picture_hash, second.picture_hash)
+        first.delete()
+        self.assertTrue(get_picture_store().exists(second.picture_hash))
+        second.delete()
+        self.assertFalse(get_picture_store().exists(second.picture_hash))
+
+    def test_picture_conditional_get(self):
+        ad = self.create_ad('with picture', b'fake png bytes')
+        response = self.client.get(ad.picture_url())
+        self.assertEqual(response['ETag'], '"%s"' % ad.picture_hash)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(ad.picture_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('ads:ad_picture', kwargs={'pk': ad.id}))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_picture_url_changes_with_the_picture(self):
+        first = self.create_ad('first', b'first bytes')
+        second = self.create_ad('second', b'second bytes')
+        self.assertNotEqual(first.picture_url(), second.picture_url())
+        response = self.client.get(reverse('ads:ad_detail', kwargs={'pk': first.id}))
+        self.assertContains(response, first.picture_url())
+
+    def test_picture_range_requests(self):
+        ad = self.create_ad('with picture', b'0123456789')
+        url = reverse('ads:ad_picture', kwargs={'pk': ad.id})
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        # The client's copy is outdated: it gets the whole picture
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+
+    @skipIf(thumbnails.Image is None, 'Pillow is not installed')
+    def test_thumbnails(self):
+        image = io.BytesIO()
+        thumbnails.Image.new('RGB', (1600, 1200), 'orange').save(image, 'PNG')
+        ad = self.create_ad('with picture', image.getvalue())
+
+        # The thumbnails are made by the job queued by the upload, until then the original is sent, but not for good
+        response = self.client.get(ad.thumbnail_url())
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+        self.assertEqual(run_pending(), 1)
+
+        response = self.client.get(ad.thumbnail_url())
+        self.assertEqual(response['Content-Type'], thumbnails.CONTENT_TYPE)
+        self.assertIn('immutable', response['Cache-Control'])
+        thumb = thumbnails.Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(thumb.size, (160, 120))
+
+        response = self.client.get(ad.medium_picture_url())
+        medium = thumbnails.Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(medium.size, (800, 600))
+        self.assertNotEqual(response['ETag'], self.client.get(ad.picture_url())['ETag'])
+
+        response = self.client.get(reverse('ads:ad_picture_size', kwargs={'pk': ad.id, 'size': 'huge'}))
+        self.assertEqual(response.status_code, 404)
+
+    @skipIf(thumbnails.Image is None, 'Pillow is not installed')
+    def test_picture_content_type_is_sniffed(self):
+        image = io.BytesIO()
+        thumbnails.Image.new('RGB', (10, 10), 'orange').save(image, 'GIF')
+        ad = self.create_ad('with picture', image.getvalue())
+        self.assertEqual(ad.content_type, 'image/png')
+        run_pending()
+        ad.refresh_from_db()
+        self.assertEqual(ad.content_type, 'image/gif')
+
+    def test_not_an_image_falls_back_to_the_original(self):
+        ad = self.create_ad('with picture', b'fake png bytes')
+        run_pending()
+        response = self.client.get(ad.thumbnail_url())
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(b''.join(response.streaming_content), b'fake png bytes')
+
+
+class ListingQueryTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser(
+            username='test_user',
+            email='test@email.com',
+            password='secret'
+        )
+        self.ad = Ad.objects.create(title='just a test', text='a very long text ' * 20, owner=self.user)
+
+    def assertNoHeavyColumns(self, queries):
+        listing_queries = [query['sql'] for query in queries if 'FROM "ads_ad"' in query['sql']]
+        self.assertTrue(listing_queries)
+        for sql in listing_queries:
+            self.assertNotIn('"ads_ad"."text"', sql)
+            self.assertNotIn('"ads_ad"."picture"', sql)
+
+    def test_excerpt(self):
+        self.assertEqual(self.ad.excerpt, self.ad.text[:Ad.EXCERPT_LENGTH])
+        self.ad.text = 'short'
+        self.ad.save(update_fields=['text'])
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.excerpt, 'short')
+
+    def test_save_without_the_text(self):
+        # The deferred text is not loaded, the excerpt is not written
+        ad = Ad.objects.for_listing().get(id=self.ad.id)
+        ad.price = 5
+        with CaptureQueriesContext(connection) as context:
+            ad.save(update_fields=['price'])
+        self.assertEqual(len(context), 1)
+        self.assertNotIn('excerpt', context.captured_queries[0]['sql'])
+
+        self.ad.price = 7
+        with CaptureQueriesContext(connection) as context:
+            self.ad.save(update_fields=['price'])
+        self.assertNotIn('excerpt', context.captured_queries[0]['sql'])
+
+    def test_ad_list_does_not_load_text_or_picture(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('ads:all'))
+        self.assertContains(response, self.ad.text[:99])
+        self.assertNoHeavyColumns(context.captured_queries)
+
+    def test_search_does_not_load_text_or_picture(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('ads:all'), {'search': 'long'})
+        self.assertContains(response, 'just a test')
+        self.assertNoHeavyColumns(context.captured_queries)
+
+    def test_admin_list_does_not_load_text_or_picture(self):
+        self.client.login(username='test_user', password='secret')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('admin:ads_ad_changelist'))
+        self.assertContains(response, 'just a test')
+        self.assertNoHeavyColumns(context.captured_queries)
+
+
+class QueryCountTests(TestCase):
+    """The list and detail pages must run the same number of queries whatever the number of ads, tags and comments."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owners = [
+            get_user_model().objects.create_user(username='user_%d' % i, password='secret') for i in range(10)
+        ]
+        cls.user = owners[0]
+        Ad.objects.bulk_create(
+            Ad(title='ad %d' % i, text='text %d' % i, excerpt='text %d' % i, owner=owners[i % 10]) for i in range(50)
+        )
+        cls.ad = Ad.objects.first()
+        cls.ad.tags.add(*['tag%d' % i for i in range(20)])
+        Comment.objects.bulk_create(
+            Comment(text='comment %d' % i, ad=cls.ad, owner=owners[i % 10]) for i in range(100)
+        )
+        Fav.objects.bulk_create(Fav(ad=ad, user=cls.user) for ad in Ad.objects.all()[:20])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ad_list_anonymous(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ads:all'))
+        self.assertContains(response, 'posted by user_9')
+
+    def test_ad_list_authenticated(self):
+        self.client.force_login(self.user)
+        # session, user, favorites, ads
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('ads:all'))
+        self.assertContains(response, 'Edit')
+
+    def test_ad_list_favorites_are_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('ads:all'))
+        # session, user, ads
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('ads:all'))
+        page_ids = {ad.id for ad in response.context['ad_list']}
+        expected = set(Fav.objects.filter(user=self.user, ad_id__in=page_ids).values_list('ad_id', flat=True))
+        self.assertEqual(response.context['favorites'], expected)
+
+    def test_favorite_views_update_the_cache(self):
+        self.client.force_login(self.user)
+        ad = Ad.objects.exclude(fav__user=self.user).order_by('-updated_at', '-id').first()
+        self.assertNotIn(ad.id, self.client.get(reverse('ads:all')).context['favorites'])
+
+        self.client.post(reverse('ads:ad_favorite', kwargs={'pk': ad.id}))
+        self.assertIn(ad.id, self.client.get(reverse('ads:all')).context['favorites'])
+
+        self.client.post(reverse('ads:ad_unfavorite', kwargs={'pk': ad.id}))
+        self.assertNotIn(ad.id, self.client.get(reverse('ads:all')).context['favorites'])
+
+    def test_ad_detail_anonymous(self):
+        # ad, tags, comments
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('ads:ad_detail', kwargs={'pk': self.ad.id}))
+        self.assertContains(response, 'tag19')
+        self.assertContains(response, 'comment 99')
+
+    def test_ad_detail_authenticated(self):
+        self.client.force_login(self.user)
+        # session, user, ad, tags, comments
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('ads:ad_detail', kwargs={'pk': self.ad.id}))
+        self.assertContains(response, 'fa-trash')
+
+    def test_ad_detail_shows_the_first_comments(self):
+        response = self.client.get(reverse('ads:ad_detail', kwargs={'pk': self.ad.id}))
+        newest = list(Comment.objects.filter(ad=self.ad).order_by('-updated_at', '-id').values_list('text', flat=True))
+        self.assertEqual([comment.text for comment in response.context['comments']], newest[:20])
+        self.assertContains(response, 'id="more_comments"')
+
+    def test_comment_pages(self):
+        context = self.client.get(reverse('ads:ad_detail', kwargs={'pk': self.ad.id})).context
+        seen, url = [comment.text for comment in context['comments']], context['next_comments_url']
+        while url:
+            # The comments only
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            seen += re.findall(r'comment \d+', data['html'])
+            url = data['next']
+        newest = list(Comment.objects.filter(ad=self.ad).order_by('-updated_at', '-id').values_list('text', flat=True))
+        self.assertEqual(seen, newest)
+
+    def test_comment_page_shows_the_delete_links(self):
+        self.client.force_login(self.user)
+        url = self.client.get(reverse('ads:ad_detail', kwargs={'pk': self.ad.id})).context['next_comments_url']
+        html = self.client.get(url).json()['html']
+        # user_0 wrote one comment in ten
+        self.assertEqual(html.count('fa-trash'), 2)
+
+    def test_ad_list_pages(self):
+        seen = []
+        url = reverse('ads:all')
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            page = response.context['page']
+            seen += [ad.id for ad in page]
+            url = reverse('ads:all') + '?after=' + page.next_cursor if page.has_next else None
+        self.assertEqual(seen, list(Ad.objects.order_by('-updated_at', '-id').values_list('id', flat=True)))
+        self.assertContains(response, 'Previous')
+        self.assertNotContains(response, 'Next')
+
+    def test_ad_list_page_uses_the_index(self):
+        first_page = self.client.get(reverse('ads:all')).context['page']
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('ads:all'), {'after': first_page.next_cursor})
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + context.captured_queries[0]['sql'])
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('ads_ad_updated_at_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class AnonymousCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.ad = Ad.objects.create(title='just a test', text='Ehy', owner=self.user)
+
+    # The generation is evicted while pages of the first generations are still cached: they must not come back
+    def test_evicted_generation_does_not_bring_back_old_pages(self):
+        url = reverse('ads:all')
+        self.client.get(url)
+        for generation in range(1, 3):
+            cache.set('pages:%d:%s' % (generation, hashlib.md5(('http://testserver' + url).encode()).hexdigest()),
+                      HttpResponse('stale page'))
+        cache.delete(GENERATION_KEY)
+        invalidate_pages()
+        self.assertNotContains(self.client.get(url), 'stale page')
+
+    def test_anonymous_pages_are_cached(self):
+        for url in [reverse('home'), reverse('ads:all'), reverse('ads:ad_detail', kwargs={'pk': self.ad.id})]:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_changes_invalidate_the_pages(self):
+        detail_url = reverse('ads:ad_detail', kwargs={'pk': self.ad.id})
+        self.client.get(reverse('ads:all'))
+        self.client.get(detail_url)
+
+        self.ad.title = 'a new title'
+        self.ad.save()
+        self.assertContains(self.client.get(reverse('ads:all')), 'a new title')
+
+        Comment.objects.create(text='a comment', ad=self.ad, owner=self.user)
+        self.assertContains(self.client.get(detail_url), 'a comment')
+
+        self.ad.tags.add('bicycle')
+        self.assertContains(self.client.get(detail_url), 'bicycle')
+
+    def test_logged_in_users_are_not_served_from_the_cache(self):
+        self.client.get(reverse('ads:all'))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('ads:all'))
+        self.assertContains(response, 'Logout')
+        self.assertNotContains(response, 'Login')
+
+
+class FavoriteToggleTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.other = get_user_model().objects.create_user(username='other_user', password='secret')
+        self.ad = Ad.objects.create(title='just a test', text='Ehy', owner=self.user)
+        add_favorite(self.other, self.ad.id)
+        self.url = reverse('ads:ad_favorite_toggle', kwargs={'pk': self.ad.id})
+
+    def test_toggle(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url)
+        self.assertEqual(response.json(), {'favorite': True, 'count': 2})
+        response = self.client.post(self.url)
+        self.assertEqual(response.json(), {'favorite': False, 'count': 1})
+
+    # A star clicked between the query of favorite_ids() and the caching of its answer
+    def test_star_clicked_while_the_favorites_are_read(self):
+        cache.clear()
+        query = Fav.objects.filter
+
+        def query_then_click(*args, **kwargs):
+            found = list(query(*args, **kwargs).values_list('ad_id', flat=True))
+            add_favorite(self.user, self.ad.id)
+            return mock.Mock(values_list=mock.Mock(return_value=found))
+
+        with mock.patch.object(Fav.objects, 'filter', side_effect=query_then_click):
+            self.assertEqual(favorite_ids(self.user, [self.ad.id]), set())
+        self.assertEqual(favorite_ids(self.user, [self.ad.id]), {self.ad.id})
+
+    def test_set_state(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            response = self.client.post(self.url, {'favorite': '1'})
+            self.assertEqual(response.json(), {'favorite': True, 'count': 2})
+        self.assertEqual(Fav.objects.filter(ad=self.ad, user=self.user).count(), 1)
+        response = self.client.post(self.url, {'favorite': '0'})
+        self.assertEqual(response.json(), {'favorite': False, 'count': 1})
+
+    def test_set_state_is_a_single_upsert(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(self.url, {'favorite': '1'})
+        fav_queries = [query['sql'] for query in context.captured_queries if 'ads_fav' in query['sql']]
+        self.assertEqual(len(fav_queries), 1)
+        self.assertIn('ON CONFLICT DO NOTHING', fav_queries[0])
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(client.post(self.url).status_code, 403)
+        self.assertFalse(Fav.objects.filter(ad=self.ad, user=self.user).exists())
+
+        # The token the list page gives to its script
+        token = client.get(reverse('ads:all')).context['csrf_token']
+        response = client.post(self.url, HTTP_X_CSRFTOKEN=str(token))
+        self.assertEqual(response.json(), {'favorite': True, 'count': 2})
+
+    def test_login_required(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 405)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.ad = Ad.objects.create(title='just a test', text='Ehy', owner=self.user)
+        self.client.force_login(self.user)
+
+    def test_favorite_views_update_the_counter(self):
+        self.client.post(reverse('ads:ad_favorite', kwargs={'pk': self.ad.id}))
+        self.client.post(reverse('ads:ad_favorite', kwargs={'pk': self.ad.id}))
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.favorite_count, 1)
+        self.client.post(reverse('ads:ad_unfavorite', kwargs={'pk': self.ad.id}))
+        self.client.post(reverse('ads:ad_unfavorite', kwargs={'pk': self.ad.id}))
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.favorite_count, 0)
+
+    def test_comment_views_update_the_counter(self):
+        self.client.post(reverse('ads:ad_comment_create', kwargs={'pk': self.ad.id}), {'comment': 'a comment'})
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.comment_count, 1)
+        comment = Comment.objects.get(ad=self.ad)
+        self.client.post(reverse('ads:ad_comment_delete', kwargs={'pk': comment.id}))
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.comment_count, 0)
+
+    # A favorite added while the ad is being edited is not lost when the edit is saved
+    def test_update_view_keeps_the_counters(self):
+        def clean(form):
+            add_favorite(self.user, self.ad.id)
+            return original_clean(form)
+
+        original_clean = CreateForm.clean
+        with mock.patch.object(CreateForm, 'clean', clean):
+            response = self.client.post(
+                reverse('ads:ad_update', kwargs={'pk': self.ad.id}), {'title': 'renamed', 'text': 'Ehy', 'price': '1.00'}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.ad.refresh_from_db()
+        self.assertEqual((self.ad.title, self.ad.favorite_count), ('renamed', 1))
+
+    def test_popular_sort(self):
+        popular = Ad.objects.create(title='popular', text='Ehy', owner=self.user)
+        Ad.objects.create(title='newest', text='Ehy', owner=self.user)
+        add_favorite(self.user, popular.id)
+        response = self.client.get(reverse('ads:all'), {'sort': 'popular'})
+        self.assertEqual(response.context['ad_list'][0], popular)
+
+    def test_reconcile_command(self):
+        Fav.objects.create(ad=self.ad, user=self.user)
+        Comment.objects.create(text='a comment', ad=self.ad, owner=self.user)
+        out = io.StringIO()
+        call_command('reconcile_ad_counters', stdout=out)
+        self.assertIn('Fixed the counters of 1 ads', out.getvalue())
+        self.ad.refresh_from_db()
+        self.assertEqual((self.ad.favorite_count, self.ad.comment_count), (1, 1))
+        call_command('reconcile_ad_counters', '--dry-run', stdout=out)
+        self.assertIn('0 ads with wrong counters', out.getvalue())
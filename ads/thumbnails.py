@@ -0,0 +1,65 @@
+import io
+
+from ads.storage import get_picture_store
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional: without it the original pictures are served
+    Image = None
+
+
+"""Smaller copies of the pictures. The ad detail page shows a picture at half the width of the page and the ad list only needs
+a small preview, but the original upload can weigh up to a couple of megabytes: so for every picture we make a few resized
+and recompressed copies ("variants") once, store them next to the original (see storage.py), and the pages ask for the
+variant they need with the 'ad_picture_size' URL. WebP files are much smaller than JPEG ones at the same quality, we use
+JPEG only when Pillow was built without WebP support.
+More info: https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.thumbnail"""
+# The longest side of each variant, in pixels
+SIZES = {
+    'thumb': 160,
+    'medium': 800,
+}
+QUALITY = 80
+
+if Image is not None and features.check('webp'):
+    FORMAT, EXTENSION, CONTENT_TYPE = 'WEBP', 'webp', 'image/webp'
+else:
+    FORMAT, EXTENSION, CONTENT_TYPE = 'JPEG', 'jpg', 'image/jpeg'
+
+
+def variant_name(size):
+    return '%s.%s' % (size, EXTENSION)
+
+
+def render_variant(image, size):
+    copy = image.copy()
+    copy.thumbnail((SIZES[size], SIZES[size]))
+    if FORMAT == 'JPEG':
+        copy = copy.convert('RGB')
+    elif copy.mode not in ('RGB', 'RGBA'):
+        copy = copy.convert('RGBA' if 'A' in copy.mode or 'transparency' in copy.info else 'RGB')
+    out = io.BytesIO()
+    copy.save(out, FORMAT, quality=QUALITY)
+    return out.getvalue()
+
+
+def make_thumbnails(digest):
+    """Make the variants of the picture digest and return their names. Returns an empty list if Pillow is not
+    installed or if the file is not an image Pillow can read."""
+    if Image is None:
+        return []
+    store = get_picture_store()
+    with store.open(digest) as f:
+        try:
+            image = Image.open(f)
+            # Turn the picture the right way up (phones store the orientation apart) before dropping the metadata
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return []
+    names = []
+    for size in SIZES:
+        name = variant_name(size)
+        store.put(store.variant_key(digest, name), render_variant(image, size))
+        names.append(name)
+    return names
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from ads.storage import get_picture_store
+
+
+"""Django reads the uploaded files with "upload handlers": by default a small file is kept in memory and a larger one is
+written to a temporary file, and then the form copies it again into the picture store. PictureUploadHandler skips the
+middle step for the picture of an ad: each chunk of the request body is written to the store (and hashed) as soon as it is
+received, so an upload takes the same little memory whatever its size. The size is checked on the way too: past the
+limit the chunks are just counted and dropped, and the form reports the error.
+More info: https://docs.djangoproject.com/en/3.2/topics/http/file-uploads/#upload-handlers"""
+class StoredPicture(UploadedFile):
+    """What the form receives instead of the file: the picture is already in the store under 'digest'
+    (None if it was too large to be kept)."""
+
+    def __init__(self, name, content_type, size, digest, charset=None, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.digest = digest
+
+
+class PictureUploadHandler(FileUploadHandler):
+    field_name = 'picture'
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.ADS_PICTURE_MAX_SIZE
+        self.writer = None
+        # The pictures this upload added to the store (not the ones it already had), see PictureUploadMixin in views.py
+        self.stored = []
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.writer = None
+        if field_name != self.field_name:
+            return
+        self.writer = get_picture_store().writer()
+        self.received = 0
+        # The default handlers do not need to keep a copy of this file
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        self.received += len(raw_data)
+        if self.received <= self.max_size:
+            self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        if file_size <= self.max_size:
+            digest = self.writer.commit()
+            if self.writer.created:
+                self.stored.append(digest)
+        else:
+            self.writer.discard()
+            digest = None
+        self.writer = None
+        return StoredPicture(
+            self.file_name, self.content_type, file_size, digest, self.charset, self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
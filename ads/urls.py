@@ -1,12 +1,23 @@
-from django.urls import path, reverse_lazy
-from . import views
+from django.urls import include, path, reverse_lazy
+from rest_framework.routers import DefaultRouter
+
+from . import api, views
 
 
 app_name='ads'
 
+# The JSON API, see api.py
+router = DefaultRouter()
+router.register('ads', api.AdViewSet, basename='api-ad')
+router.register('comments', api.CommentViewSet, basename='api-comment')
+router.register('favorites', api.FavoriteViewSet, basename='api-favorite')
+router.register('tags', api.TagViewSet, basename='api-tag')
+
 urlpatterns = [
     path('', views.AdListView.as_view(), name='all'),
     path('ad/<int:pk>', views.AdDetailView.as_view(), name='ad_detail'),
+    path('tag/<slug:slug>', views.TagAdListView.as_view(), name='tag'),
+    path('tags', views.TagCloudView.as_view(), name='tag_cloud'),
     path('ad/create',
         views.AdCreateView.as_view(success_url=reverse_lazy('ads:all')), name='ad_create'),
     path('ad/<int:pk>/update',
@@ -14,10 +25,14 @@ urlpatterns = [
     path('ad/<int:pk>/delete',
         views.AdDeleteView.as_view(success_url=reverse_lazy('ads:all')), name='ad_delete'),
     path('ad_picture/<int:pk>', views.stream_file, name='ad_picture'),
+    path('ad_picture/<int:pk>/<slug:size>', views.stream_file, name='ad_picture_size'),
     path('ad/<int:pk>/comment',
         views.CommentCreateView.as_view(), name='ad_comment_create'),
+    path('ad/<int:pk>/comments', views.comment_page, name='ad_comments'),
     path('comment/<int:pk>/delete',
         views.CommentDeleteView.as_view(success_url=reverse_lazy('ads')), name='ad_comment_delete'),
     path('ad/<int:pk>/favorite', views.AddFavoriteView.as_view(), name='ad_favorite'),
     path('ad/<int:pk>/unfavorite', views.DeleteFavoriteView.as_view(), name='ad_unfavorite'),
+    path('ad/<int:pk>/favorite/toggle', views.toggle_favorite_view, name='ad_favorite_toggle'),
+    path('api/', include(router.urls)),
 ]
@@ -1,81 +1,209 @@
+import calendar
+import datetime
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.humanize.templatetags.humanize import naturaltime
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.db.utils import IntegrityError
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from taggit.models import Tag
+
 
+from home.cache import cache_anonymous
+from home.db import read_from_replica
+from home.pagination import KeysetPaginator
+from jobs.queue import enqueue
 
-from ads.models import Ad, Comment, Fav
+from ads import search, thumbnails
+from ads.counters import change_counter
+from ads.favorites import add_favorite, favorite_ids, remove_favorite, toggle_favorite
+from ads.models import Ad, Comment, TaggedAd
 from ads.owner import OwnerListView, OwnerDetailView, OwnerDeleteView
 from ads.forms import CreateForm, CommentForm
+from ads.http import RangeNotSatisfiable, if_range_matches, parse_range, partial_response
+from ads.storage import get_picture_store
+from ads.tags import tag_cloud
+from ads.tasks import delete_unused_picture, process_picture
+from ads.uploads import PictureUploadHandler
 
 
 # NOTICE THAT Each class is a subclass of owner views contained in owner.py file. For more info go to coursera_ads_app/ads/owner.py
+# The list and the detail pages seen by logged-out visitors are served from the cache, see home/cache.py, and their
+# queries go to a read replica if there is one, see home/db.py
 # AdList creates a list of the advertisements allocated in the database, and they are shown up in the page 'ad_list'."""
+@method_decorator(cache_anonymous, name='get')
+@method_decorator(read_from_replica, name='get')
 class AdListView(OwnerListView):
     model = Ad
     template_name = "ads/ad_list.html"
+    paginate_by = 10
+    # The 'sort' parameter picks one of these. Each must match an index of Ad, see home/pagination.py
+    orderings = {
+        'recent': ('-updated_at', '-id'),
+        'popular': ('-favorite_count', '-id'),
+    }
+    ordering = orderings['recent']
     
-    """We override the get module of the generic ListView to include the possibility to mark favorite ads. Firstly it checks if a user is authenticated,
-    then it retrieves the id field of the favorite ads (line 30) and finally creates a list of the different ids (line 31). 
+    """We override the get module of the generic ListView to include the possibility to mark favorite ads. Once the ads of the page
+    are known, if the user is authenticated we look up which of them are favorites (see favorites.py, which keeps the answers in the cache)
+    and get back a set, so the template checks 'ad.id in favorites' without going through a list.
     For a deeper explanation see: https://www.youtube.com/watch?v=o0XbHvKxw7Y&t=45959s at minute 17:24:45"""
     def get(self, request) :
-        ad_list = Ad.objects.all()
-        favorites = list()
-        if request.user.is_authenticated:
-            rows = request.user.favorite_ads.values('id')
-            favorites = [ row['id'] for row in rows ]
-        
         """Code for the 'search' bar. If the user enters text in it, it will query the database and retrieve all the results which contain
-        the searched words either in the title or in the text (line 43-44); if the user hits the search button without writing something,
-        the search will show the first 10 ads ordered by the update time."""
+        the searched words either in the title or in the text (the 10 best matches); if the user hits the search button without writing something,
+        the search will show the first 10 ads ordered by the update time. Without a search, the 'after' and 'before' parameters
+        of the next/previous links hold the cursor of the page to show (see home/pagination.py)."""
+        page = None
+        sort = request.GET.get('sort') if request.GET.get('sort') in self.orderings else 'recent'
         strval =  request.GET.get("search", False)
         if strval :
             """Simple title-only search:
-            objects = Post.objects.filter(title__contains=strval).select_related().order_by('-updated_at')[:10]"""
+            objects = Post.objects.filter(title__contains=strval).select_related().order_by('-updated_at')[:10]
 
-            # Multi-field search
-            # __icontains is for case-insensitive search
-            query = Q(title__icontains=strval)
-            query.add(Q(text__icontains=strval), Q.OR)
-            ad_list = Ad.objects.filter(query).select_related().order_by('-updated_at')[:10]
+            The multi-field search used to be Q(title__icontains=strval) | Q(text__icontains=strval), which scans the whole table.
+            Now it goes through the full-text index (see search.py): the results are ranked by relevance and every word
+            is matched as a prefix, so 'bik' finds 'bike'."""
+            ad_list = search.search(Ad.objects.for_listing(), strval, limit=10)
         else :
-            ad_list = Ad.objects.all().order_by('-updated_at')[:10]
+            paginator = KeysetPaginator(Ad.objects.for_listing(), self.orderings[sort], self.paginate_by)
+            page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+            ad_list = page.object_list
+
+        context = {'ad_list' : ad_list, 'favorites': self.prepare(request, ad_list), 'search': strval, 'page': page,
+                   'sort': sort}
+        return render(request, self.template_name, context)
 
+    # What the template needs on top of the ads: the date, and which of them the user likes. Returns the set of the favorites
+    def prepare(self, request, ad_list):
         # Augment the post_list adding the updated_at field
         for obj in ad_list:
             obj.natural_updated = naturaltime(obj.updated_at)
 
-        context = {'ad_list' : ad_list, 'favorites': favorites, 'search': strval}
+        favorites = set()
+        if request.user.is_authenticated:
+            favorites = favorite_ids(request.user, [obj.id for obj in ad_list])
+        return favorites
+
+
+"""The ads with a tag, newest first. The page is read from TaggedAd (see models.py) with the keyset pagination of the ad list,
+ordered by the id of the ad: the index on (tag, -ad) gives the ids of the page straight away, however many ads have the tag,
+and the ads are then loaded by id."""
+@method_decorator(cache_anonymous, name='get')
+@method_decorator(read_from_replica, name='get')
+class TagAdListView(AdListView):
+    def get(self, request, slug):
+        tag = get_object_or_404(Tag, slug=slug)
+        paginator = KeysetPaginator(
+            TaggedAd.objects.filter(tag=tag).only('content_object_id'), ('-content_object_id',), self.paginate_by
+        )
+        page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+        ads = Ad.objects.for_listing().in_bulk([tagged.content_object_id for tagged in page])
+        ad_list = [ads[tagged.content_object_id] for tagged in page if tagged.content_object_id in ads]
+        # The tag page also shows the other tags of each ad, one query for the whole page
+        prefetch_related_objects(ad_list, 'tags')
+
+        context = {'ad_list': ad_list, 'favorites': self.prepare(request, ad_list), 'page': page, 'tag': tag}
         return render(request, self.template_name, context)
 
 
+# The most used tags, see tags.tag_cloud
+@method_decorator(cache_anonymous, name='get')
+@method_decorator(read_from_replica, name='get')
+class TagCloudView(View):
+    template_name = 'ads/tag_cloud.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {'tags': tag_cloud()})
+
+
+"""The comments of an ad are shown newest first, a page at a time: the first COMMENTS_PER_PAGE with the ad, the next ones
+loaded by the page as the user scrolls down (see comment_page). The pages are cut with the keyset pagination of
+home/pagination.py, in the order of the (ad, -updated_at, -id) index of Comment, so a page costs the same on an ad
+with 20,000 comments as on one with 20."""
+COMMENTS_PER_PAGE = 20
+
+
+def comment_paginator(ad_id):
+    return KeysetPaginator(Comment.objects.filter(ad_id=ad_id), ('-updated_at', '-id'), COMMENTS_PER_PAGE)
+
+
+def next_comments_url(ad_id, page):
+    if not page.has_next:
+        return None
+    return '%s?after=%s' % (reverse('ads:ad_comments', args=[ad_id]), page.next_cursor)
+
+
+@method_decorator(cache_anonymous, name='get')
+@method_decorator(read_from_replica, name='get')
 class AdDetailView(OwnerDetailView):
     model = Ad
     template_name = 'ads/ad_detail.html'
     
     """We override the get request to include comments in the ad. Here 'retrieved_ad' points to the ad the user chooses to open,
-    while 'ad' points to the homonym field in the model 'Comment'; in this way we retrieve a list of comments associated with 
-    the chosen ad (comments = Comment.object), ordered by their update time (order_by('-updated_at'))."""
+    while 'ad' points to the homonym field in the model 'Comment'; in this way we retrieve the first page of comments associated with
+    the chosen ad, ordered by their update time (see comment_paginator).
+    The tags are fetched together with the ad (prefetch_related runs one query for all of them), and the template compares
+    owner_id with the id of the user instead of loading the owner of the ad and of every comment, so the page always
+    runs the same few queries however many tags and comments there are."""
     def get(self, request, pk) :
-        retrieved_ad = Ad.objects.get(id=pk)
-        comments = Comment.objects.filter(ad=retrieved_ad).order_by('-updated_at')
+        retrieved_ad = get_object_or_404(Ad.objects.prefetch_related('tags'), id=pk)
+        comments = comment_paginator(retrieved_ad.id).page()
         comment_form = CommentForm()
-        context = { 'ad' : retrieved_ad, 'comments': comments, 'comment_form': comment_form }
+        context = { 'ad' : retrieved_ad, 'comments': comments, 'comment_form': comment_form,
+                    'next_comments_url': next_comments_url(retrieved_ad.id, comments) }
         return render(request, self.template_name, context)
 
 
+# The page of comments after the 'after' cursor, as JSON: the HTML to append to the list and the URL of the next page
+# (null after the last one)
+@cache_anonymous
+@read_from_replica
+def comment_page(request, pk):
+    page = comment_paginator(pk).page(after=request.GET.get('after'))
+    html = render_to_string('ads/comment_list.html', {'comments': page}, request=request)
+    return JsonResponse({'html': html, 'next': next_comments_url(pk, page)})
+
+
 class AdDeleteView(OwnerDeleteView):
     model = Ad
 
 
+"""The create and update views write the uploaded picture straight to the picture store (see uploads.py). The upload handler
+has to be installed before the request body is read, but the CSRF middleware reads it (to find the token) before calling
+the view: so the middleware skips these views (csrf_exempt) and the check is done in post(), after the handler is in place.
+As the picture is stored before the CSRF and form checks, a request that fails them leaves it behind: once the view is done,
+a picture this request added and no ad points to is deleted by a job, UNUSED_PICTURE_DELAY later. Not at once, as another
+request uploading the same bytes at the same time shares the file and may not have saved its ad yet.
+More info: https://docs.djangoproject.com/en/3.2/topics/http/file-uploads/#modifying-upload-handlers-on-the-fly"""
+UNUSED_PICTURE_DELAY = datetime.timedelta(hours=1)
+
+
+class PictureUploadMixin:
+    def dispatch(self, request, *args, **kwargs):
+        handler = PictureUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            for digest in handler.stored:
+                if not Ad.objects.filter(picture_hash=digest).exists():
+                    enqueue(delete_unused_picture, digest, delay=UNUSED_PICTURE_DELAY)
+
+
 # To create an ad we use a form, CreateForm; we override the get method to use this form and create a context dictionary from it.
-class AdCreateView(LoginRequiredMixin, View):
+@method_decorator(csrf_exempt, name='dispatch')
+class AdCreateView(LoginRequiredMixin, PictureUploadMixin, View):
     template_name = 'ads/ad_form.html'
     success_url = reverse_lazy('ads:all')
 
@@ -85,6 +213,7 @@ class AdCreateView(LoginRequiredMixin, View):
         return render(request, self.template_name, ctx)
 
     # Pull data
+    @method_decorator(csrf_protect)
     def post(self, request, pk=None):
         form = CreateForm(request.POST, request.FILES or None)
 
@@ -98,10 +227,13 @@ class AdCreateView(LoginRequiredMixin, View):
         pic.owner = self.request.user
         pic.save()
         form.save_m2m()
+        if form.new_picture:
+            enqueue(process_picture, pic.id)
         return redirect(self.success_url)
 
 
-class AdUpdateView(LoginRequiredMixin, View):
+@method_decorator(csrf_exempt, name='dispatch')
+class AdUpdateView(LoginRequiredMixin, PictureUploadMixin, View):
     template_name = 'ads/ad_form.html'
     success_url = reverse_lazy('ads:all')
 
@@ -112,6 +244,7 @@ class AdUpdateView(LoginRequiredMixin, View):
         ctx = {'form': form}
         return render(request, self.template_name, ctx)
 
+    @method_decorator(csrf_protect)
     def post(self, request, pk=None):
         pic = get_object_or_404(Ad, id=pk, owner=self.request.user)
         form = CreateForm(request.POST, request.FILES or None, instance=pic)
@@ -121,27 +254,86 @@ class AdUpdateView(LoginRequiredMixin, View):
             return render(request, self.template_name, ctx)
 
         pic = form.save(commit=False)
-        pic.save
+        pic.save(update_fields=form.changed_fields())
         form.save_m2m()
+        if form.new_picture:
+            enqueue(process_picture, pic.id)
 
         return redirect(self.success_url)
 
     
-def stream_file(request, pk):
-    pic = get_object_or_404(Ad, id=pk)
-    response = HttpResponse()
-    response['Content-Type'] = pic.content_type
-    response['Content-Length'] = len(pic.picture)
-    response.write(pic.picture)
+"""Send the picture of an ad. The bytes are not in the database (see storage.py), so we only load the hash and the content type
+of the ad and hand the open file to a FileResponse: the file is sent in chunks instead of being read into memory, and when the
+server supports it (wsgi.file_wrapper, e.g. gunicorn or uWSGI) the kernel copies it straight to the socket with sendfile().
+More info: https://docs.djangoproject.com/en/3.2/ref/request-response/#fileresponse-objects
+
+The response can be cached: the ETag is the hash of the picture and Last-Modified is the update time of the ad, so a browser
+asking again with If-None-Match/If-Modified-Since gets an empty '304 Not Modified' (get_conditional_response does the checks).
+When the URL carries the current version of the picture (see Ad.picture_url) the picture behind it can never change, so it
+can be cached for a year without asking again. Range requests are answered with only the asked bytes (see http.py).
+More info: https://developer.mozilla.org/en-US/docs/Web/HTTP/Caching
+
+With a 'size' (see thumbnails.SIZES) we send the resized copy of the picture instead, or the original if there is no such copy
+(it is not made yet, or the upload is not an image Pillow can read). The original sent in place of a copy must not be cached
+for a year, or the browser would keep it after the copy is made: it is sent with no-cache, so the browser asks again and gets
+the copy as soon as it exists (its ETag differs from the one of the original)."""
+PICTURE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def stream_file(request, pk, size=None):
+    if size is not None and size not in thumbnails.SIZES:
+        raise Http404('No such picture size')
+    pic = get_object_or_404(Ad.objects.only('content_type', 'picture_hash', 'updated_at'), id=pk)
+    if not pic.picture_hash:
+        raise Http404('This ad has no picture')
+
+    store = get_picture_store()
+    key, content_type = pic.picture_hash, pic.content_type
+    if size is not None:
+        variant_key = store.variant_key(pic.picture_hash, thumbnails.variant_name(size))
+        if store.exists(variant_key):
+            key, content_type = variant_key, thumbnails.CONTENT_TYPE
+    etag = '"%s"' % key
+    last_modified = calendar.timegm(pic.updated_at.utctimetuple())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            f = store.open(key)
+        except FileNotFoundError:
+            raise Http404('The picture is missing from the store')
+        length = store.size(key)
+        try:
+            byte_range = None
+            if if_range_matches(request, etag, last_modified):
+                byte_range = parse_range(request.META.get('HTTP_RANGE'), length)
+        except RangeNotSatisfiable:
+            response = partial_response(f, length, None, content_type)
+        else:
+            if byte_range is None:
+                response = FileResponse(f, content_type=content_type)
+            else:
+                response = partial_response(f, length, byte_range, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if request.GET.get('v') == pic.picture_version and (size is None or key != pic.picture_hash):
+        patch_cache_control(response, public=True, max_age=PICTURE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
     return response
 
 
 # Pull ad data from the database, post a comment, then redirect the user to the ad detail page
+# The comment and the comment_count of the ad (see counters.py) are saved together
 class CommentCreateView(LoginRequiredMixin, View):
     def post(self, request, pk) :
         ad = get_object_or_404(Ad, id=pk)
         comment = Comment(text=request.POST['comment'], owner=request.user, ad=ad)
-        comment.save()
+        with transaction.atomic():
+            comment.save()
+            change_counter(ad.id, 'comment_count', 1)
         return redirect(reverse('ads:ad_detail', args=[pk]))
 
 
@@ -151,32 +343,62 @@ class CommentDeleteView(OwnerDeleteView):
 
     # https://stackoverflow.com/questions/26290415/deleteview-with-a-dynamic-success-url-dependent-on-id
     def get_success_url(self):
-        ad = self.object.ad
-        return reverse('ads:ad_detail', args=[ad.id])
+        return reverse('ads:ad_detail', args=[self.object.ad_id])
+
+    @transaction.atomic
+    def delete(self, request, *args, **kwargs):
+        response = super().delete(request, *args, **kwargs)
+        change_counter(self.object.ad_id, 'comment_count', -1)
+        return response
 
 
 # csrf_exempt tells the view not to create a csrf token
+# Both views run a single statement, see favorites.py. The ad is not loaded first: adding a favorite to an ad that
+# does not exist breaks the foreign key of Fav, which we turn into a 404.
 @method_decorator(csrf_exempt, name='dispatch')
 class AddFavoriteView(LoginRequiredMixin, View):
     def post(self, request, pk) :
-        print("Add PK",pk)
-        t = get_object_or_404(Ad, id=pk)
-        fav = Fav(user=request.user, ad=t)
         try:
-            fav.save()  # In case of duplicate key
-        except IntegrityError as e:
-            pass
+            with transaction.atomic():
+                add_favorite(request.user, pk)
+        except IntegrityError:
+            raise Http404('No such ad')
         return HttpResponse()
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class DeleteFavoriteView(LoginRequiredMixin, View):
     def post(self, request, pk) :
-        print("Delete PK",pk)
-        t = get_object_or_404(Ad, id=pk)
-        try:
-            fav = Fav.objects.get(user=request.user, ad=t).delete()
-        except Fav.DoesNotExist as e:
-            pass
-
+        remove_favorite(request.user, pk)
         return HttpResponse()
+
+
+"""A single endpoint for the stars of the ad list, answering with the new state and the number of users who like the ad.
+It is an async view (https://docs.djangoproject.com/en/3.2/topics/async/): under an ASGI server (e.g. 'uvicorn mysite.asgi:application')
+the worker is not tied up while the database works. The ORM is not async yet, so the database work runs in sync_to_async.
+The client should send the state it wants in 'favorite' (1 or 0), without it the state is flipped.
+Django 3.2 decorators such as login_required or require_POST do not support async views, hence the checks by hand.
+The CSRF check is done by CsrfViewMiddleware as for any other view: the page sends the token in the X-CSRFToken header."""
+async def toggle_favorite_view(request, pk):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await sync_to_async(_authenticated_user)(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    wanted = request.POST.get('favorite')
+    is_favorite = None if wanted not in ('0', '1') else wanted == '1'
+    try:
+        is_favorite, count = await sync_to_async(_toggle_favorite)(user, pk, is_favorite)
+    except IntegrityError:
+        raise Http404('No such ad')
+    return JsonResponse({'favorite': is_favorite, 'count': count})
+
+
+def _authenticated_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+def _toggle_favorite(user, pk, is_favorite):
+    is_favorite = toggle_favorite(user, pk, is_favorite)
+    return is_favorite, Ad.objects.filter(id=pk).values_list('favorite_count', flat=True).first()
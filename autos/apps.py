@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AutosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'autos'
+
+    def ready(self):
+        # The number of makes shown by the list page is cached, see home/lists.py
+        from home.lists import track_count
+        track_count(self.get_model('Make'))
@@ -1,3 +1,85 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from home.pagination import KeysetPaginator
+
+from autos.models import Auto, Make
+
+
+class AutoListTests(TestCase):
+    AUTOS = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='driver', password='secret')
+        makes = [Make.objects.create(name='make %d' % i) for i in range(20)]
+        Auto.objects.bulk_create((
+            Auto(make=makes[i % 20], nickname='auto %d' % i, mileage=i, comments='Runs')
+            for i in range(cls.AUTOS)
+        ), batch_size=1000)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_list_pages(self):
+        self.client.get(reverse('autos:all'))
+        # session, user, autos with their makes (the number of makes is cached)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('autos:all'))
+        self.assertEqual(len(response.context['auto_list']), 20)
+        self.assertEqual(response.context['make_count'], 20)
+        self.assertContains(response, 'auto 0 (make 0)')
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('autos:all'), {'after': response.context['page'].next_cursor})
+        self.assertContains(response, 'auto 20 (make 0)')
+        self.assertContains(response, 'Previous')
+
+    def test_last_page(self):
+        # A cursor at the end of the table costs the same as the first page
+        before_last = Auto.objects.order_by('-id')[20]
+        cursor = KeysetPaginator(Auto.objects.all(), ('id',), 20).encode_cursor(before_last)
+        self.client.get(reverse('autos:all'))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('autos:all'), {'after': cursor})
+        self.assertEqual(len(response.context['auto_list']), 20)
+        self.assertContains(response, 'auto %d' % (self.AUTOS - 1))
+        self.assertNotContains(response, 'Next')
+
+    def test_page_uses_the_primary_key(self):
+        cursor = self.client.get(reverse('autos:all')).context['page'].next_cursor
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('autos:all'), {'after': cursor})
+        [sql] = [query['sql'] for query in context.captured_queries if 'autos_auto' in query['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('INTEGER PRIMARY KEY', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_make_count_is_cached(self):
+        self.client.get(reverse('autos:all'))
+        Make.objects.create(name='new make')
+        self.assertEqual(self.client.get(reverse('autos:all')).context['make_count'], 21)
+        Make.objects.get(name='new make').delete()
+        self.assertEqual(self.client.get(reverse('autos:all')).context['make_count'], 20)
+
+    def test_count_made_before_a_change_is_not_kept(self):
+        count = Make.objects.count
+
+        # A make is added after the count but before it is cached
+        def count_then_add():
+            counted = count()
+            Make.objects.create(name='new make')
+            return counted
 
-# Create your tests here.
+        with mock.patch.object(Make.objects, 'count', side_effect=count_then_add):
+            self.assertEqual(self.client.get(reverse('autos:all')).context['make_count'], 20)
+        self.assertEqual(self.client.get(reverse('autos:all')).context['make_count'], 21)
@@ -4,16 +4,18 @@ from django.views import View
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 
-from autos.models import Auto, Make
+from home.lists import KeysetListView
 
+from autos.models import Auto, Make
 
-class MainView(LoginRequiredMixin, View):
-    def get(self, request):
-        mc = Make.objects.all().count()
-        al = Auto.objects.all()
 
-        ctx = {'make_count': mc, 'auto_list': al}
-        return render(request, 'autos/auto_list.html', ctx)
+# The list is paginated and joins the make of each auto, see home/lists.py
+class MainView(LoginRequiredMixin, KeysetListView):
+    model = Auto
+    lookup_field = 'make'
+    lookup_count_name = 'make_count'
+    template_name = 'autos/auto_list.html'
+    context_object_name = 'auto_list'
 
 
 class MakeView(LoginRequiredMixin, View):
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cats'
+
+    def ready(self):
+        # The number of breeds shown by the list page is cached, see home/lists.py
+        from home.lists import track_count
+        track_count(self.get_model('Breed'))
@@ -1,3 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from cats.models import Breed, Cat
+
+
+class CatListTests(TestCase):
+    CATS = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='owner', password='secret')
+        breeds = [Breed.objects.create(name='breed %d' % i) for i in range(10)]
+        Cat.objects.bulk_create((
+            Cat(breed=breeds[i % 10], nickname='cat %d' % i, weight=4, foods='Fish')
+            for i in range(cls.CATS)
+        ), batch_size=1000)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_list_pages(self):
+        # session, user, cats with their breeds, count of the breeds
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('cats:all_cats'))
+        self.assertContains(response, 'cat 0 (breed 0)')
+        self.assertEqual(response.context['breed_count'], 10)
+
+        # The count is cached now
+        seen = [cat.id for cat in response.context['cat_list']]
+        for _ in range(3):
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('cats:all_cats'), {'after': response.context['page'].next_cursor})
+            seen += [cat.id for cat in response.context['cat_list']]
+        self.assertEqual(seen, list(Cat.objects.order_by('id').values_list('id', flat=True)[:80]))
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('cats:all_cats'), {'before': response.context['page'].previous_cursor})
+        self.assertEqual([cat.id for cat in response.context['cat_list']], seen[40:60])
+
+    def test_breed_count_follows_the_breeds(self):
+        self.client.get(reverse('cats:all_cats'))
+        self.client.post(reverse('cats:breed_create'), {'name': 'Siamese'})
+        self.assertEqual(self.client.get(reverse('cats:all_cats')).context['breed_count'], 11)
@@ -4,16 +4,18 @@ from django.views import View
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 
-from cats.models import Cat, Breed
+from home.lists import KeysetListView
 
+from cats.models import Cat, Breed
 
-class CatList(LoginRequiredMixin, View):
-    def get(self, request):
-        breed_count = Breed.objects.all().count()
-        cat = Cat.objects.all()
 
-        context = {'breed_count': breed_count, 'cat_list': cat}
-        return render(request, 'cats/cat_list.html', context)
+# The list is paginated and joins the breed of each cat, see home/lists.py
+class CatList(LoginRequiredMixin, KeysetListView):
+    model = Cat
+    lookup_field = 'breed'
+    lookup_count_name = 'breed_count'
+    template_name = 'cats/cat_list.html'
+    context_object_name = 'cat_list'
 
 
 class BreedView(LoginRequiredMixin, View):
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class HomeConfig(AppConfig):
     name = 'home'
+
+    def ready(self):
+        # Connect the database health checks
+        from home import db  # noqa: F401
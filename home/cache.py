@@ -0,0 +1,81 @@
+import hashlib
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from home.db import read_from_primary
+
+
+"""Whole-page caching for logged-out visitors. Most of the traffic is anonymous browsing, and an anonymous visitor sees exactly
+the same page as any other one, so the first rendering of a page is kept in the cache and handed to the next visitors without
+touching the database. Logged-in users always get a fresh page, as it shows their own stars, edit links and forms.
+
+Instead of finding and deleting every cached page when an ad, a comment or a tag changes, every cache key contains a
+"generation" number: invalidate_pages() just increments it, and the old pages are never read again (the cache evicts
+them when they expire). See ads/signals.py for what invalidates the pages. If the number itself is evicted, it starts
+again from the time in milliseconds (see next_version), never from a generation whose pages could still be cached.
+The pages are read from a replica when there is one (see home/db.py), which can be a little behind the primary: the first
+visitor after an invalidation would put in the cache the page without the change that caused it, for everyone, until the
+page expires. So for DATABASE_REPLICA_LAG seconds after an invalidation the pages are filled from the primary.
+More info: https://docs.djangoproject.com/en/3.2/topics/cache/"""
+GENERATION_KEY = 'pages:generation'
+# Set for DATABASE_REPLICA_LAG seconds after an invalidation
+RECENTLY_INVALIDATED_KEY = 'pages:recently_invalidated'
+
+
+def _generation():
+    return cache.get(GENERATION_KEY) or next_version(GENERATION_KEY)
+
+
+def invalidate_pages():
+    if settings.DATABASE_REPLICAS:
+        cache.set(RECENTLY_INVALIDATED_KEY, 1, settings.DATABASE_REPLICA_LAG)
+    next_version(GENERATION_KEY)
+
+
+def next_version(key):
+    """Increment the version number kept in key and return the new one. A missing key (never set, or evicted) starts from
+    the time in milliseconds, so it does not go back to a version whose entries could still be in the cache."""
+    while True:
+        version = int(time.time() * 1000)
+        if cache.add(key, version, None):
+            return version
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            pass
+
+
+def _cacheable(request, response):
+    # A page using {% csrf_token %} holds a token that belongs to one visitor only
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def cache_anonymous(view_func):
+    """Decorator serving the GET requests of logged-out users from the cache. To use it on a class-based view:
+    @method_decorator(cache_anonymous, name='get')"""
+    @wraps(view_func)
+    def wrapped_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = 'pages:%d:%s' % (_generation(), url)
+        response = cache.get(key)
+        if response is None:
+            recent = settings.DATABASE_REPLICAS and cache.get(RECENTLY_INVALIDATED_KEY)
+            with read_from_primary() if recent else nullcontext():
+                response = view_func(request, *args, **kwargs)
+            if _cacheable(request, response):
+                cache.set(key, response, settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+        return response
+    return wrapped_view
@@ -0,0 +1,135 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+"""Read replicas. A replica is a copy of the database kept up to date by the database server itself (e.g. MySQL
+replication), which can answer the reads so that the primary only has the writes to do. Django picks the database of
+each query with the routers in DATABASE_ROUTERS: ReplicaRouter sends the reads to one of the DATABASE_REPLICAS, but only
+inside the views decorated with @read_from_replica (the ad list and detail pages, see ads/views.py), all the rest
+keeps using the primary ('default').
+A replica is a little behind the primary: a user who just posted a comment could go back to the ad and not see it. So
+after a POST (or any other write) ReplicaPinMiddleware sets a cookie and, while it lasts (DATABASE_REPLICA_LAG seconds),
+the views of that user read from the primary.
+The users and the sessions are always read from the primary, even in those views: a session saved (or a user who logged
+in) a moment ago could be missing from the replica, and the request would look logged out.
+More info: https://docs.djangoproject.com/en/3.2/topics/db/multi-db/#database-routers"""
+_use_replica = ContextVar('use_replica', default=False)
+_force_primary = ContextVar('force_primary', default=False)
+
+PIN_COOKIE = 'primary_until'
+
+
+class ReplicaRouter:
+    PRIMARY_APPS = {'auth', 'sessions'}
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or not settings.DATABASE_REPLICAS:
+            return None
+        if model._meta.app_label in self.PRIMARY_APPS or model._meta.label == settings.AUTH_USER_MODEL:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    # The replicas hold the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def _pinned_to_primary(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_from_replica(view):
+    """Run the reads of a view on a replica (for GET and HEAD requests)."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or _pinned_to_primary(request) or _force_primary.get():
+            return view(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+@contextmanager
+def read_from_primary():
+    """Keep the views decorated with @read_from_replica on the primary, e.g. to fill a cache (see home/cache.py)."""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+class ReplicaPinMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            until = time.time() + settings.DATABASE_REPLICA_LAG
+            response.set_cookie(PIN_COOKIE, '%.0f' % until, max_age=settings.DATABASE_REPLICA_LAG, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+"""Persistent connections (CONN_MAX_AGE) save opening a connection on every request, but a kept connection can die in the
+meantime (the server restarted, or closed it after its wait_timeout) and the next request would fail on it. When
+DB_HEALTH_CHECKS is on, a kept connection is checked (is_usable(), a ping on MySQL) at the start of each request and
+replaced if it does not answer. Django 3.2 does not do this by itself (Django 4.1 added CONN_HEALTH_CHECKS).
+More info: https://docs.djangoproject.com/en/3.2/ref/databases/#persistent-connections"""
+@receiver(request_started)
+def close_broken_connections(**kwargs):
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+
+
+def check_databases():
+    """Run a trivial query on every database and return {alias: None if it answered, else the error}."""
+    status = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            status[alias] = None
+        except Exception as e:
+            status[alias] = str(e) or e.__class__.__name__
+    return status
+
+
+"""SQLite in production (DB_SQLITE_PRODUCTION=1, see settings.py): every new connection gets the PRAGMAs of SQLITE_PRAGMAS.
+The important one is journal_mode=WAL: by default a write locks the whole file and the readers wait (or fail with
+"database is locked"), while with a write-ahead log the readers keep reading the last committed data during a write.
+With WAL, synchronous=NORMAL is still safe from corruption (a power cut can only lose the last transactions), mmap_size
+and cache_size keep more of the database in memory, and busy_timeout makes a writer wait for another one instead of failing.
+More info: https://www.sqlite.org/wal.html and https://www.sqlite.org/pragma.html"""
+@receiver(connection_created)
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and settings.SQLITE_PRAGMAS:
+        apply_sqlite_pragmas(connection)
+
+
+def apply_sqlite_pragmas(connection):
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
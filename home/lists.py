@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.shortcuts import render
+from django.views import View
+
+from home.cache import next_version
+from home.pagination import KeysetPaginator
+
+
+"""A list page shared by the CRUD apps (autos, cats): a model with a foreign key to a "lookup" model (Auto -> Make,
+Cat -> Breed) whose name is shown on each row, and the number of lookup rows under the list.
+It used to load the whole table with .all(), then the template ran one more query per row to get the lookup
+(the "N+1 queries" problem) and the page counted the lookups with COUNT(*) every time. Now:
+    - the rows come a page at a time, with the keyset pagination of home/pagination.py
+    - the lookup is joined in the same query (select_related)
+    - the count of the lookups is kept in the cache, under a version that moves on when a lookup is added or deleted
+      (see track_count). Deleting the count instead would let a request that counted just before the change store its
+      count just after, and keep it: with the version, that count goes under the old one, which is not read anymore
+So the page runs the same couple of queries however big the table is.
+More info on select_related: https://docs.djangoproject.com/en/3.2/ref/models/querysets/#select-related"""
+COUNT_KEY = 'lists:count:%s:%d'
+COUNT_VERSION_KEY = 'lists:count_version:%s'
+COUNT_TIMEOUT = 24 * 60 * 60
+
+
+def cached_count(model):
+    version_key = COUNT_VERSION_KEY % model._meta.label_lower
+    version = cache.get(version_key) or next_version(version_key)
+    return cache.get_or_set(COUNT_KEY % (model._meta.label_lower, version), model.objects.count, COUNT_TIMEOUT)
+
+
+def _drop_count(sender, **kwargs):
+    next_version(COUNT_VERSION_KEY % sender._meta.label_lower)
+
+
+def track_count(model):
+    """Keep cached_count(model) up to date, call it from the ready() of the app. Rows added or deleted in bulk
+    (bulk_create, queryset.delete() without signals) are not seen."""
+    uid = 'lists.track_count.%s' % model._meta.label_lower
+    post_save.connect(_drop_count, sender=model, dispatch_uid=uid)
+    post_delete.connect(_drop_count, sender=model, dispatch_uid=uid)
+
+
+class KeysetListView(View):
+    model = None
+    # The foreign key shown on each row, and the context variable with the number of rows of the model it points to
+    lookup_field = None
+    lookup_count_name = None
+    template_name = None
+    context_object_name = None
+    # The last field must be unique, see home/pagination.py
+    ordering = ('id',)
+    paginate_by = 20
+
+    def get_queryset(self):
+        return self.model.objects.select_related(self.lookup_field)
+
+    def get(self, request):
+        paginator = KeysetPaginator(self.get_queryset(), self.ordering, self.paginate_by)
+        page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+        lookup_model = self.model._meta.get_field(self.lookup_field).related_model
+        context = {
+            self.context_object_name: page.object_list,
+            self.lookup_count_name: cached_count(lookup_model),
+            'page': page,
+        }
+        return render(request, self.template_name, context)
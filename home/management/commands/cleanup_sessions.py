@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from home.sessions import clear_expired_sessions
+from home.tasks import schedule_session_cleanup
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired sessions in small batches (--schedule: repeat it in the job worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Sessions deleted per statement')
+        parser.add_argument('--schedule', action='store_true',
+                            help='Queue a job doing it every SESSION_CLEANUP_INTERVAL seconds instead, see home/tasks.py')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            job = schedule_session_cleanup()
+            self.stdout.write(self.style.SUCCESS('Scheduled' if job else 'Already scheduled'))
+            return
+        deleted = clear_expired_sessions(options['batch_size'])
+        if deleted is None:
+            self.stdout.write('This session engine does not keep the sessions in the database')
+        else:
+            self.stdout.write(self.style.SUCCESS('Deleted %d expired sessions' % deleted))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+"""Regular care for a SQLite database, e.g. from a daily cron job:
+    - ANALYZE updates the statistics (the sqlite_stat1 table) the query planner uses to pick indexes. analysis_limit
+      makes it look at a sample of each index instead of reading all of it, so it stays quick on a large database
+    - wal_checkpoint copies the write-ahead log back into the database file and empties it, so it does not keep growing
+    - VACUUM (only with --vacuum) rebuilds the file without the free pages left by deleted rows. It blocks all the writes
+      while it runs and needs as much free disk space as the database, so run it when the site is quiet
+More info: https://www.sqlite.org/lang_analyze.html, https://www.sqlite.org/pragma.html#pragma_wal_checkpoint
+and https://www.sqlite.org/lang_vacuum.html"""
+class Command(BaseCommand):
+    help = 'Run ANALYZE, checkpoint the write-ahead log and optionally VACUUM the SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database to work on')
+        parser.add_argument('--vacuum', action='store_true', help='Also rebuild the database file')
+        parser.add_argument('--no-analyze', action='store_false', dest='analyze', help='Skip ANALYZE')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only for SQLite databases')
+
+        with connection.cursor() as cursor:
+            if options['analyze']:
+                # Not 'PRAGMA optimize': it only analyzes the tables the queries of its own connection used, so on
+                # the fresh connection of this command it does nothing
+                cursor.execute('PRAGMA analysis_limit = 1000')
+                cursor.execute('ANALYZE')
+                self.stdout.write('Analyzed the tables')
+            if options['vacuum']:
+                cursor.execute('PRAGMA freelist_count')
+                free_pages = cursor.fetchone()[0]
+                cursor.execute('VACUUM')
+                self.stdout.write('Vacuumed the database, %d free pages reclaimed' % free_pages)
+
+            cursor.execute('PRAGMA journal_mode')
+            if cursor.fetchone()[0].lower() == 'wal':
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                busy, log_pages, checkpointed = cursor.fetchone()
+                if busy:
+                    self.stderr.write('The checkpoint could not complete, a reader or writer was busy')
+                else:
+                    self.stdout.write('Checkpointed %d pages of the write-ahead log' % checkpointed)
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,28 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+"""SQLite has no replication: to try the replica routing locally (see home/db.py), start the site with
+DB_REPLICA_NAME=replica.sqlite3 and copy the primary database to it with this command whenever it should catch up.
+It uses SQLite's online backup, so the site can keep running meanwhile. More info: https://www.sqlite.org/backup.html"""
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary database to the SQLite replicas'
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Only for SQLite, the other databases replicate by themselves')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('There is no replica, set DB_REPLICA_NAME')
+        source = sqlite3.connect(str(settings.DATABASES['default']['NAME']))
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(str(settings.DATABASES[alias]['NAME']))
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS('Copied the database to %s' % alias))
+        finally:
+            source.close()
@@ -0,0 +1,193 @@
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+
+"""What each request costs. MetricsMiddleware measures, for every request, the total time, the number of SQL queries and the
+time spent in them, the time spent rendering templates and the size of the response, and adds them up per URL name
+(e.g. 'ads:all'). They are shown in two places:
+    - the Server-Timing header of the response, which the browser developer tools show in the "Timing" tab
+      (https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing)
+    - the /metrics page, in the text format read by Prometheus (https://prometheus.io/docs/instrumenting/exposition_formats/)
+The totals are kept in the memory of the process: with several worker processes, each one counts its own requests.
+A query slower than METRICS_SLOW_QUERY_MS is logged with the view it came from (only a sample of them, see
+METRICS_SLOW_QUERY_SAMPLE_RATE, so that a slow database does not flood the logs)."""
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.view_name = None
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+"""The SQL queries are timed with a database "execute wrapper", a function every query goes through.
+More info: https://docs.djangoproject.com/en/3.2/topics/db/instrumentation/"""
+class QueryTimer:
+    def __init__(self, stats, request):
+        self.stats = stats
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.stats.queries += 1
+            self.stats.db_time += duration
+            if duration * 1000 >= settings.METRICS_SLOW_QUERY_MS \
+                    and random.random() < settings.METRICS_SLOW_QUERY_SAMPLE_RATE:
+                logger.warning(
+                    'Slow query (%.1f ms) in %s %s: %s', duration * 1000, _view_name(self.request),
+                    self.request.path, sql
+                )
+
+
+"""Template rendering is timed by the template backend (the BACKEND of TEMPLATES in settings.py): it is Django's own, except
+that the templates it returns record how long render() took. The templates included by a template are rendered by
+that render() call, so they are counted once."""
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.template_time += time.perf_counter() - start
+
+
+# The limits of the histogram of the request durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.response_bytes = 0
+
+
+class Registry:
+    """The totals per URL name, shared by the threads of the process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view_name, duration, stats, response_bytes):
+        with self.lock:
+            metrics = self.views.setdefault(view_name, ViewMetrics())
+            metrics.requests += 1
+            metrics.duration += duration
+            for i, limit in enumerate(DURATION_BUCKETS):
+                if duration <= limit:
+                    metrics.buckets[i] += 1
+            metrics.queries += stats.queries
+            metrics.db_time += stats.db_time
+            metrics.template_time += stats.template_time
+            metrics.response_bytes += response_bytes
+
+    def clear(self):
+        with self.lock:
+            self.views = {}
+
+    def export(self):
+        """The totals in the Prometheus text format."""
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP http_request_duration_seconds Time spent answering requests, per URL name',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for name, metrics in views:
+                for limit, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    lines.append('http_request_duration_seconds_bucket{view="%s",le="%s"} %d' % (name, limit, count))
+                lines.append('http_request_duration_seconds_bucket{view="%s",le="+Inf"} %d' % (name, metrics.requests))
+                lines.append('http_request_duration_seconds_sum{view="%s"} %f' % (name, metrics.duration))
+                lines.append('http_request_duration_seconds_count{view="%s"} %d' % (name, metrics.requests))
+            for metric, kind, description, attribute in COUNTERS:
+                lines.append('# HELP %s %s' % (metric, description))
+                lines.append('# TYPE %s %s' % (metric, kind))
+                for name, metrics in views:
+                    value = getattr(metrics, attribute)
+                    lines.append('%s{view="%s"} %s' % (metric, name, value if isinstance(value, int) else '%f' % value))
+        return '\n'.join(lines) + '\n'
+
+
+COUNTERS = (
+    ('db_queries_total', 'counter', 'SQL queries run, per URL name', 'queries'),
+    ('db_query_duration_seconds_total', 'counter', 'Time spent in SQL queries, per URL name', 'db_time'),
+    ('template_render_seconds_total', 'counter', 'Time spent rendering templates, per URL name', 'template_time'),
+    ('http_response_bytes_total', 'counter', 'Size of the response bodies, per URL name', 'response_bytes'),
+)
+
+registry = Registry()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+"""The middleware goes first in MIDDLEWARE, so that the time of the other middlewares is counted too.
+More info on middlewares: https://docs.djangoproject.com/en/3.2/topics/http/middleware/"""
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(QueryTimer(stats, request)))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        if response.streaming:
+            response_bytes = int(response.get('Content-Length', 0))
+        else:
+            response_bytes = len(response.content)
+        registry.record(_view_name(request), duration, stats, response_bytes)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (stats.db_time * 1000, stats.queries),
+            'tpl;dur=%.1f' % (stats.template_time * 1000),
+            'total;dur=%.1f' % (duration * 1000),
+        ])
+        return response
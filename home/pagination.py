@@ -0,0 +1,108 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+"""Keyset (or "cursor") pagination. Django's Paginator asks the database for OFFSET n rows, and the database still has to
+walk through those n rows before returning the page: page 10,000 is a lot slower than page 1. Here a page is instead
+described by the sort key of the last row shown ("the ads older than this one"), which the database finds straight away
+with an index on the ordering columns, so every page costs the same.
+The price is that you can only go to the next or the previous page, not jump to page 42.
+More info: https://use-the-index-luke.com/no-offset"""
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate queryset by the fields in ordering, e.g. ('-updated_at', '-id'). The last field must be unique
+    (the primary key is a good choice), so that rows with the same value in the other fields are not skipped.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, name) for name in self.fields]
+        data = json.dumps([value if isinstance(value, int) else str(value) for value in values])
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return the field values stored in cursor, or None if it is not a valid cursor (e.g. an edited URL)."""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+            model = self.queryset.model
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except (ValueError, TypeError, binascii.Error, FieldDoesNotExist, ValidationError):
+            return None
+
+    def _seek(self, values, forward):
+        """Build the filter for the rows after (or before) values. For ordering (-a, -b) and forward it is
+        'a <= va AND (a < va OR (a = va AND b < vb))': the first part lets the database start reading the index at va."""
+        def lookup(i):
+            # Going forward on a descending field means going to smaller values
+            return 'lt' if self.descending[i] == forward else 'gt'
+
+        alternatives = Q()
+        for i, name in enumerate(self.fields):
+            step = Q(**dict(zip(self.fields[:i], values[:i])))
+            step &= Q(**{'%s__%s' % (name, lookup(i)): values[i]})
+            alternatives |= step
+        first = self.fields[0]
+        return Q(**{'%s__%se' % (first, lookup(0)): values[0]}) & alternatives
+
+    def page(self, after=None, before=None):
+        """Return the page following the 'after' cursor, the page preceding the 'before' cursor, or the first page."""
+        after_values = self.decode_cursor(after) if after else None
+        before_values = self.decode_cursor(before) if before else None
+
+        if before_values is not None:
+            reversed_ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+            queryset = self.queryset.filter(self._seek(before_values, forward=False)).order_by(*reversed_ordering)
+            rows = list(queryset[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            object_list = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+            if after_values is not None:
+                queryset = queryset.filter(self._seek(after_values, forward=True))
+            rows = list(queryset[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            object_list = rows[:self.per_page]
+            has_previous = after_values is not None
+
+        if not object_list:
+            return KeysetPage(object_list, None, None)
+        return KeysetPage(
+            object_list,
+            self.encode_cursor(object_list[-1]) if has_next else None,
+            self.encode_cursor(object_list[0]) if has_previous else None,
+        )
@@ -0,0 +1,57 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+
+"""The session engines of the site (SESSION_ENGINE, see SESSION_BACKEND in settings.py). Each module of this package is the
+Django engine of the same name with one change: a session is only written back when its data really changed.
+Django saves the session whenever a value is assigned, even the value it already had (e.g. a view doing
+request.session['cart'] = cart on every hit), and with the database engines every save is an UPDATE of django_session,
+which on SQLite locks the whole database. Here the data is serialized when it is loaded, and compared again at the end
+of the request: SessionMiddleware only saves (and sends the cookie) when it differs.
+More info: https://docs.djangoproject.com/en/3.2/topics/http/sessions/#when-sessions-are-saved"""
+class SaveIfChangedMixin:
+    _loaded = None
+
+    def load(self):
+        data = super().load()
+        self._loaded = (self.session_key, self.serializer().dumps(data))
+        return data
+
+    @property
+    def modified(self):
+        return self._modified and self._changed()
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = value
+
+    def _changed(self):
+        # Never loaded (e.g. a new session): trust the flag
+        if self._loaded is None:
+            return True
+        key, data = self._loaded
+        return key != self.session_key or data != self.serializer().dumps(self._get_session())
+
+
+def clear_expired_sessions(batch_size=1000):
+    """Delete the expired sessions and return how many there were (None if the engine cannot tell). The database
+    engines delete them batch_size rows at a time, so that the database is not locked for long (clearsessions deletes
+    them all in one statement). The cache engine leaves them to the cache, and signed cookies expire by themselves."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not issubclass(store, DBStore):
+        try:
+            store.clear_expired()
+        except NotImplementedError:
+            pass
+        return None
+    model = store.get_model_class()
+    expired = model.objects.filter(expire_date__lt=timezone.now())
+    deleted = 0
+    while True:
+        keys = list(expired.values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        deleted += model.objects.filter(session_key__in=keys).delete()[0]
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cache
+
+from home.sessions import SaveIfChangedMixin
+
+
+class SessionStore(SaveIfChangedMixin, cache.SessionStore):
+    pass
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cached_db
+
+from home.sessions import SaveIfChangedMixin
+
+
+class SessionStore(SaveIfChangedMixin, cached_db.SessionStore):
+    pass
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import db
+
+from home.sessions import SaveIfChangedMixin
+
+
+class SessionStore(SaveIfChangedMixin, db.SessionStore):
+    pass
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import signed_cookies
+
+from home.sessions import SaveIfChangedMixin
+
+
+class SessionStore(SaveIfChangedMixin, signed_cookies.SessionStore):
+    pass
@@ -0,0 +1,24 @@
+import datetime
+
+from django.conf import settings
+
+from home.sessions import clear_expired_sessions
+from jobs.models import Job
+from jobs.queue import enqueue, task
+
+
+"""Delete the expired sessions every SESSION_CLEANUP_INTERVAL seconds in the job worker: each run queues the next one.
+Start it once with 'python manage.py cleanup_sessions --schedule'."""
+@task
+def cleanup_sessions():
+    try:
+        clear_expired_sessions()
+    finally:
+        schedule_session_cleanup()
+
+
+def schedule_session_cleanup():
+    """Queue the next cleanup, unless one is already waiting. Returns the job, or None."""
+    if Job.objects.filter(name=cleanup_sessions.task_name, status=Job.PENDING).exists():
+        return None
+    return enqueue(cleanup_sessions, delay=datetime.timedelta(seconds=settings.SESSION_CLEANUP_INTERVAL))
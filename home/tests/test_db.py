@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ads import search
+from ads.models import Ad
+from home.cache import GENERATION_KEY, RECENTLY_INVALIDATED_KEY, invalidate_pages
+from home.db import PIN_COOKIE, ReplicaRouter, read_from_replica
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test_user', password='secret')
+        self.ad = Ad.objects.create(title='an ad', text='Ehy', owner=self.user)
+        # What replication would do
+        get_user_model().objects.using('replica').bulk_create([self.user])
+        Ad.objects.using('replica').bulk_create([self.ad])
+
+    def test_router(self):
+        router = ReplicaRouter()
+        routed = []
+        view = read_from_replica(lambda request: routed.append(router.db_for_read(Ad)))
+        view(RequestFactory().get('/'))
+        view(RequestFactory().post('/'))
+        self.assertEqual(routed, ['replica', None])
+        self.assertIsNone(router.db_for_read(Ad))
+        self.assertEqual(router.db_for_write(Ad), 'default')
+
+    def test_users_and_sessions_are_read_from_the_primary(self):
+        router = ReplicaRouter()
+        routed = []
+        models = (get_user_model(), Session)
+        view = read_from_replica(lambda request: routed.extend(router.db_for_read(model) for model in models))
+        view(RequestFactory().get('/'))
+        self.assertEqual(routed, ['default', 'default'])
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('ads:all'))
+        self.assertFalse(any('django_session' in query['sql'] for query in replica.captured_queries))
+
+    def test_search_reads_from_one_database(self):
+        # Only the replica has the ad in its index
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('INSERT INTO %s (rowid, title, text) VALUES (%%s, %%s, %%s)' % search.FTS_TABLE,
+                           [self.ad.id, 'replicated', 'Ehy'])
+        view = read_from_replica(lambda request: search.search(Ad.objects.all(), 'replicated'))
+        with CaptureQueriesContext(connections['default']) as default:
+            self.assertEqual(view(RequestFactory().get('/')), [self.ad])
+        self.assertEqual(default.captured_queries, [])
+
+    def test_ad_pages_read_from_the_replica(self):
+        self.client.force_login(self.user)
+        for url in (reverse('ads:all'), reverse('ads:ad_detail', args=[self.ad.id])):
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertTrue(any('ads_ad' in query['sql'] for query in replica.captured_queries))
+
+    def test_pages_cached_right_after_a_change_come_from_the_primary(self):
+        cache.clear()
+        invalidate_pages()
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('ads:all'))
+        self.assertEqual(replica.captured_queries, [])
+
+        # Once the replica has caught up
+        cache.delete(RECENTLY_INVALIDATED_KEY)
+        cache.incr(GENERATION_KEY)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('ads:all'))
+        self.assertTrue(any('ads_ad' in query['sql'] for query in replica.captured_queries))
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('ads:ad_comment_create', args=[self.ad.id]), {'comment': 'nice one'})
+        self.assertGreater(float(response.cookies[PIN_COOKIE].value), time.time())
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('ads:ad_detail', args=[self.ad.id]))
+        self.assertEqual(replica.captured_queries, [])
+
+
+class HealthTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def test_health(self):
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'status': 'ok', 'databases': {'default': 'ok', 'replica': 'ok'}, 'cache': 'ok'
+        })
+
+
+class SQLiteTests(TestCase):
+    @override_settings(SQLITE_PRAGMAS={
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY', 'cache_size': -1024
+    })
+    def test_pragmas_on_new_connections(self):
+        # A file database, as the test database lives in memory where there is no write-ahead log
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        default = connections['default']
+        new_connection = default.__class__(dict(default.settings_dict, NAME=os.path.join(directory, 'db.sqlite3')), 'tmp')
+        self.addCleanup(new_connection.close)
+        with new_connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1024)
+
+    def test_maintenance(self):
+        out = StringIO()
+        # Without VACUUM, which cannot run inside the transaction of the test
+        call_command('sqlite_maintenance', stdout=out)
+        self.assertIn('Analyzed the tables', out.getvalue())
+
+    # The command runs on a connection that did not query anything yet, as it does from cron
+    def test_maintenance_analyzes_on_a_fresh_connection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        default = connections['default']
+        settings_dict = dict(default.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'))
+        setup = default.__class__(settings_dict, 'tmp')
+        with setup.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+            cursor.execute('CREATE INDEX item_name ON item (name)')
+            cursor.executemany('INSERT INTO item (name) VALUES (%s)', [('item %d' % i,) for i in range(100)])
+        setup.commit()
+        setup.close()
+
+        fresh = default.__class__(settings_dict, 'tmp')
+        self.addCleanup(fresh.close)
+        with mock.patch('home.management.commands.sqlite_maintenance.connections', {'default': fresh}):
+            call_command('sqlite_maintenance', stdout=StringIO())
+        with fresh.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'item'")
+            self.assertGreater(cursor.fetchone()[0], 0)
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ads.models import Ad
+from home.metrics import registry
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        user = get_user_model().objects.create_user(username='test_user', password='secret')
+        Ad.objects.create(title='an ad', text='Ehy', owner=user)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('ads:all'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_metrics_per_view(self):
+        self.client.get(reverse('ads:all'))
+        self.client.get(reverse('ads:all'), {'after': 'x'})
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.5']):
+            response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="ads:all"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="ads:all",le="+Inf"} 2', text)
+        self.assertIn('db_queries_total{view="ads:all"} 2', text)
+        self.assertIn('template_render_seconds_total{view="ads:all"}', text)
+        self.assertIn('http_response_bytes_total{view="ads:all"}', text)
+
+    def test_metrics_are_private(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 403)
+        # Behind a reverse proxy on the same machine every visitor comes from there
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('home.metrics', 'WARNING') as logs:
+            self.client.get(reverse('ads:all'))
+        self.assertIn('in ads:all /ads/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
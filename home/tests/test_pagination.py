@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from home.pagination import KeysetPaginator
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        User.objects.bulk_create(User(username='user_%02d' % i) for i in range(25))
+        # Every user has the same date_joined, so the id alone must keep the pages apart
+        User.objects.update(date_joined=timezone.now())
+        cls.users = list(User.objects.order_by('-date_joined', '-id'))
+
+    def paginator(self):
+        return KeysetPaginator(get_user_model().objects.all(), ('-date_joined', '-id'), 10)
+
+    def test_walk_forward_and_back(self):
+        paginator = self.paginator()
+        first = paginator.page()
+        self.assertEqual(list(first), self.users[:10])
+        self.assertFalse(first.has_previous)
+
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual(list(second), self.users[10:20])
+        third = paginator.page(after=second.next_cursor)
+        self.assertEqual(list(third), self.users[20:])
+        self.assertFalse(third.has_next)
+
+        back = paginator.page(before=third.previous_cursor)
+        self.assertEqual(list(back), self.users[10:20])
+        back = paginator.page(before=back.previous_cursor)
+        self.assertEqual(list(back), self.users[:10])
+        self.assertFalse(back.has_previous)
+
+    def test_ascending_ordering(self):
+        paginator = KeysetPaginator(get_user_model().objects.all(), ('username',), 10)
+        page = paginator.page(after=paginator.page().next_cursor)
+        self.assertEqual([user.username for user in page], ['user_%02d' % i for i in range(10, 20)])
+
+    def test_a_page_is_one_query(self):
+        paginator = self.paginator()
+        cursor = paginator.page().next_cursor
+        with self.assertNumQueries(1):
+            paginator.page(after=cursor)
+
+    def test_invalid_cursor_gives_first_page(self):
+        paginator = self.paginator()
+        for cursor in ['garbage', 'WyJub3QgYSBkYXRlIiwgMV0', 'e30']:
+            self.assertEqual(list(paginator.page(after=cursor)), self.users[:10])
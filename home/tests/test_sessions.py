@@ -0,0 +1,146 @@
+import datetime
+from importlib import import_module
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from home.sessions import clear_expired_sessions
+from jobs.models import Job
+from jobs.queue import run_pending
+
+
+class SaveIfChangedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def new_session(self, **data):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def run_request(self, session_key, view):
+        """Run view(request) between the two halves of SessionMiddleware, return the response and the SQL run."""
+        def get_response(request):
+            view(request)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+        with CaptureQueriesContext(connection) as context:
+            response = SessionMiddleware(get_response)(request)
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def assign(self, key, value):
+        def view(request):
+            request.session[key] = value
+        return view
+
+    def test_same_value_is_not_saved(self):
+        session_key = self.new_session(visits=3)
+        response, queries = self.run_request(session_key, self.assign('visits', 3))
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('SELECT'))
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_changed_value_is_saved(self):
+        session_key = self.new_session(visits=3)
+        response, queries = self.run_request(session_key, self.assign('visits', 4))
+        self.assertTrue(any(sql.startswith('UPDATE') for sql in queries))
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(Session.objects.get(session_key=session_key).get_decoded(), {'visits': 4})
+
+    def test_changed_in_place_is_saved(self):
+        session_key = self.new_session(cart=[1])
+
+        def view(request):
+            request.session['cart'].append(2)
+            request.session.modified = True
+
+        self.run_request(session_key, view)
+        self.assertEqual(Session.objects.get(session_key=session_key).get_decoded(), {'cart': [1, 2]})
+
+    def test_new_key_is_sent(self):
+        session_key = self.new_session(visits=3)
+        response, _ = self.run_request(session_key, lambda request: request.session.cycle_key())
+        new_key = response.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertNotEqual(new_key, session_key)
+        self.assertEqual(Session.objects.get(session_key=new_key).get_decoded(), {'visits': 3})
+
+    def test_new_session_is_saved(self):
+        response, _ = self.run_request('unknown', self.assign('visits', 1))
+        session = Session.objects.get(session_key=response.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.assertEqual(session.get_decoded(), {'visits': 1})
+
+    @override_settings(SESSION_ENGINE='home.sessions.signed_cookies')
+    def test_signed_cookies(self):
+        session_key = self.new_session(visits=3)
+        response, queries = self.run_request(session_key, self.assign('visits', 3))
+        self.assertEqual(queries, [])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        response, _ = self.run_request(session_key, self.assign('visits', 4))
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    @override_settings(SESSION_ENGINE='home.sessions.cached_db')
+    def test_cached_db_reads_from_the_cache(self):
+        session_key = self.new_session(visits=3)
+        _, queries = self.run_request(session_key, self.assign('visits', 3))
+        self.assertEqual(queries, [])
+
+
+class HelloSessionTests(TestCase):
+    @override_settings(SESSION_ENGINE='home.sessions.cached_db')
+    def test_visits_are_counted_without_reading_the_table(self):
+        cache.clear()
+        self.assertContains(self.client.get('/hello/'), 'view count=1')
+        # Only the write of the new count
+        with CaptureQueriesContext(connection) as context:
+            self.assertContains(self.client.get('/hello/'), 'view count=2')
+        self.assertFalse(any(query['sql'].startswith('SELECT') for query in context.captured_queries))
+
+
+class CleanupTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key='old%d' % i, session_data='', expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='current', session_data='', expire_date=now + datetime.timedelta(days=1))
+
+    def test_clear_expired_sessions(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(clear_expired_sessions(batch_size=2), 5)
+        # 3 batches, each one read and delete, then the empty read
+        self.assertEqual(len(context), 7)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+
+    @override_settings(SESSION_ENGINE='home.sessions.signed_cookies')
+    def test_nothing_to_clear(self):
+        self.assertIsNone(clear_expired_sessions())
+        self.assertEqual(Session.objects.count(), 6)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cleanup_sessions', stdout=out)
+        self.assertIn('Deleted 5 expired sessions', out.getvalue())
+
+    def test_scheduled_cleanup(self):
+        out = StringIO()
+        call_command('cleanup_sessions', '--schedule', stdout=out)
+        call_command('cleanup_sessions', '--schedule', stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[:2], ['Scheduled', 'Already scheduled'])
+
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Session.objects.count(), 1)
+        # The next one is waiting
+        job = Job.objects.get(status=Job.PENDING)
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(hours=23))
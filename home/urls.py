@@ -4,4 +4,6 @@ from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('health', views.health_view, name='health'),
 ]
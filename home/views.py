@@ -1,13 +1,24 @@
+import hmac
+
+from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
 from django.views import View
 from django.conf import settings
 
+from home.cache import cache_anonymous
+from home.db import check_databases
+from home.metrics import registry
+
 # Create your views here.
 
 # This is a little complex because we need to detect when we are
 # running in various configurations
 
 
+@method_decorator(cache_anonymous, name='get')
 class HomeView(View):
     def get(self, request):
         print(request.get_host())
@@ -18,3 +29,37 @@ class HomeView(View):
             'islocal': islocal
         }
         return render(request, 'home/main.html', context)
+
+
+# The request metrics for Prometheus (see metrics.py). Only for the staff, the clients sending METRICS_TOKEN and the
+# addresses in METRICS_ALLOWED_IPS (see settings.py), e.g. the Prometheus server scraping the site
+def metrics_view(request):
+    if not (request.user.is_staff or _has_metrics_token(request)
+            or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS):
+        raise PermissionDenied
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# compare_digest takes the same time wherever the strings differ, so the token cannot be guessed from the response times
+def _has_metrics_token(request):
+    if not settings.METRICS_TOKEN:
+        return False
+    expected = 'Bearer ' + settings.METRICS_TOKEN
+    return hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), expected.encode())
+
+
+# For load balancers and uptime monitors: 200 if every database and the cache answer, 503 otherwise
+def health_view(request):
+    databases = check_databases()
+    try:
+        cache.set('health', 1, 10)
+        cache_ok = cache.get('health') == 1
+    except Exception:
+        cache_ok = False
+    healthy = cache_ok and not any(databases.values())
+    body = {
+        'status': 'ok' if healthy else 'error',
+        'databases': {alias: error or 'ok' for alias, error in databases.items()},
+        'cache': 'ok' if cache_ok else 'error',
+    }
+    return JsonResponse(body, status=200 if healthy else 503)
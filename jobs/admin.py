@@ -0,0 +1,10 @@
+from django.contrib import admin
+from jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status', 'name')
+
+
+admin.site.register(Job, JobAdmin)
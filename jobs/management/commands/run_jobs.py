@@ -0,0 +1,50 @@
+import datetime
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs import queue, worker
+
+
+class Command(BaseCommand):
+    help = 'Run the queued jobs (see jobs/queue.py) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Size of the process pool, 0 runs the jobs in this process')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more due jobs')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a running job is considered abandoned and queued again')
+
+    def handle(self, *args, **options):
+        if options['processes'] == 0:
+            count = queue.run_pending()
+            self.stdout.write(self.style.SUCCESS('Ran %d jobs' % count))
+            return
+
+        stale_after = datetime.timedelta(seconds=options['stale_after'])
+        totals = Counter()
+        # Do not share the database connections of this process with the workers
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(options['processes'], mp_context=context, initializer=worker.init_worker) as pool:
+            try:
+                while True:
+                    queue.requeue_stale(stale_after)
+                    job_ids = queue.claim(options['processes'] * 2)
+                    if not job_ids:
+                        if options['once']:
+                            break
+                        time.sleep(options['sleep'])
+                        continue
+                    totals.update(pool.map(worker.run_in_worker, job_ids))
+            except KeyboardInterrupt:
+                self.stdout.write('Interrupted, the claimed jobs will be queued again after --stale-after seconds')
+        self.stdout.write(self.style.SUCCESS(
+            'Ran %d jobs: %s' % (sum(totals.values()), ', '.join('%d %s' % (n, s) for s, n in totals.items()))
+        ))
@@ -0,0 +1,39 @@
+from django.db import models
+from django.utils import timezone
+
+
+"""A job is a call to a task function (see queue.py) that runs later, outside of the request, in the worker started with
+'python manage.py run_jobs'. The table itself is the queue, so there is no broker (like Redis or RabbitMQ) to install.
+'name' is the registered name of the task and 'args' the JSON list of its arguments."""
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # A job is not picked up before run_after: it is how failed jobs are retried later
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # The worker always looks for the pending jobs that are due
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='jobs_job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return '%s%s (%s)' % (self.name, tuple(self.args), self.status)
@@ -0,0 +1,103 @@
+import datetime
+import logging
+import traceback
+
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = datetime.timedelta(seconds=30)
+
+TASKS = {}
+
+
+"""A small task queue stored in the database. A task is a plain function decorated with @task, usually in the 'tasks.py'
+module of an app (they are all imported when the project starts, see apps.py):
+
+    @task
+    def process_picture(ad_id):
+        ...
+
+    enqueue(process_picture, ad.id)
+
+enqueue() only inserts a Job row, so the request returns at once. The worker
+('python manage.py run_jobs') claims the due jobs, runs them and records the outcome. A failing job is tried again later,
+waiting RETRY_DELAY, then twice as long, and so on, until it has been tried max_attempts times.
+The arguments are stored as JSON, so pass ids and strings rather than model instances."""
+def task(func):
+    func.task_name = '%s.%s' % (func.__module__, func.__name__)
+    TASKS[func.task_name] = func
+    return func
+
+
+def enqueue(func, *args, delay=None, max_attempts=3):
+    run_after = timezone.now() + delay if delay else timezone.now()
+    return Job.objects.create(name=func.task_name, args=list(args), run_after=run_after, max_attempts=max_attempts)
+
+
+def claim(limit):
+    """Mark up to limit due jobs as running and return their ids. The update only succeeds if the job is still pending,
+    so when several workers race for the same job only one of them gets it."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'id')
+    claimed = []
+    for job_id in due.values_list('id', flat=True)[:limit]:
+        updated = Job.objects.filter(id=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1
+        )
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def run_job(job_id):
+    """Run a claimed job, record the outcome and return the new status of the job."""
+    job = Job.objects.get(id=job_id)
+    try:
+        func = TASKS.get(job.name)
+        if func is None:
+            raise LookupError('Unknown task %s' % job.name)
+        func(*job.args)
+    except Exception:
+        logger.exception('Job %d (%s) failed', job.id, job.name)
+        if job.attempts < job.max_attempts:
+            status = Job.PENDING
+            run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            status, run_after = Job.FAILED, job.run_after
+        Job.objects.filter(id=job.id).update(
+            status=status, run_after=run_after, locked_at=None, error=traceback.format_exc(), updated_at=timezone.now()
+        )
+        return status
+    Job.objects.filter(id=job.id).update(status=Job.DONE, locked_at=None, error='', updated_at=timezone.now())
+    return Job.DONE
+
+
+def requeue_stale(timeout):
+    """Put back in the queue the jobs running for more than timeout (a timedelta): their worker probably died. A job that
+    used all its attempts is marked failed instead, as run_job does: it may be the one killing its worker (e.g. running
+    out of memory), and would otherwise be retried forever. Returns the number of requeued jobs."""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timeout)
+    given_up = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_at=None, error='The worker stopped while running the job', updated_at=now
+    )
+    if given_up:
+        logger.error('%d stale jobs used all their attempts and failed', given_up)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Job.PENDING, locked_at=None, updated_at=now)
+
+
+def run_pending():
+    """Run all the due jobs in this process and return how many ran. Handy in tests and in the shell."""
+    count = 0
+    while True:
+        job_ids = claim(100)
+        if not job_ids:
+            return count
+        for job_id in job_ids:
+            run_job(job_id)
+        count += len(job_ids)
@@ -0,0 +1,88 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import claim, enqueue, requeue_stale, run_job, run_pending, task
+
+
+CALLS = []
+
+
+@task
+def record(value):
+    CALLS.append(value)
+
+
+@task
+def explode():
+    raise ValueError('boom')
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        job = enqueue(record, 'a')
+        self.assertEqual(job.name, 'jobs.tests.record')
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(CALLS, ['a'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+
+    def test_job_is_claimed_once(self):
+        job = enqueue(record, 'a')
+        self.assertEqual(claim(10), [job.id])
+        self.assertEqual(claim(10), [])
+
+    def test_delayed_job_is_not_due(self):
+        enqueue(record, 'a', delay=datetime.timedelta(minutes=5))
+        self.assertEqual(run_pending(), 0)
+        self.assertEqual(CALLS, [])
+
+    def test_failed_job_is_retried_then_given_up(self):
+        job = enqueue(explode, max_attempts=2)
+        [job_id] = claim(10)
+        self.assertEqual(run_job(job_id), Job.PENDING)
+        job.refresh_from_db()
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('ValueError: boom', job.error)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        [job_id] = claim(10)
+        self.assertEqual(run_job(job_id), Job.FAILED)
+
+    def test_unknown_task_fails(self):
+        job = Job.objects.create(name='jobs.tests.missing', max_attempts=1)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('Unknown task', job.error)
+
+    def test_stale_job_is_requeued(self):
+        job = enqueue(record, 'a')
+        claim(10)
+        self.assertEqual(requeue_stale(datetime.timedelta(minutes=10)), 0)
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(requeue_stale(datetime.timedelta(minutes=10)), 1)
+        self.assertEqual(run_pending(), 1)
+
+    def test_stale_job_without_attempts_left_fails(self):
+        job = enqueue(record, 'a', max_attempts=1)
+        claim(10)
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(requeue_stale(datetime.timedelta(minutes=10)), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('worker stopped', job.error)
+        self.assertEqual(run_pending(), 0)
+
+    def test_run_jobs_command_inline(self):
+        enqueue(record, 'a')
+        enqueue(record, 'b')
+        call_command('run_jobs', processes=0, stdout=StringIO())
+        self.assertEqual(CALLS, ['a', 'b'])
@@ -0,0 +1,12 @@
+"""The functions run in the processes of the 'run_jobs' pool. They are started with the 'spawn' method, so they begin as
+fresh Python interpreters: Django has to be set up there first, and this module must not import models at the top."""
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def run_in_worker(job_id):
+    from jobs.queue import run_job
+    return run_job(job_id)
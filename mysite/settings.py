@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -51,6 +52,11 @@ INSTALLED_APPS = [
 
     # My apps
     'ads.apps.AdsConfig',
+    'jobs.apps.JobsConfig',
+    'polls.apps.PollsConfig',
+    'autos.apps.AutosConfig',
+    'cats.apps.CatsConfig',
+    'hello.apps.HelloConfig',
 ]
 
 # When we get to crispy forms :)
@@ -60,6 +66,7 @@ CRISPY_TEMPLATE_PACK = 'bootstrap3'  # Add
 TAGGIT_CASE_INSENSITIVE = True
 
 MIDDLEWARE = [
+    'home.metrics.MetricsMiddleware',  # First, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,13 +75,15 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',   # Add
+    'home.db.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing the rendering for home/metrics.py
+        'BACKEND': 'home.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -94,16 +103,127 @@ TEMPLATES = [
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 
+# True when running 'python manage.py test'
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
+# Pick the database with the DB_ENGINE environment variable:
+#  - 'sqlite' (the default) uses the file DB_NAME, db.sqlite3 if not set
+#  - 'mysql' uses the database DB_NAME on DB_HOST:DB_PORT as DB_USER/DB_PASSWORD, it needs mysqlclient (in requirements.txt)
+# DB_CONN_MAX_AGE keeps the connections open between requests for that many seconds (0 closes them after each request),
+# and DB_HEALTH_CHECKS checks a kept connection still works before a request uses it (see home/db.py).
+# With DB_REPLICA_HOST (MySQL) or DB_REPLICA_NAME (another SQLite file) the ad pages read from a replica, see home/db.py
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+
+def database(name, host):
+    if DB_ENGINE == 'mysql':
+        return {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': name,
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            },
+        }
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+    }
 
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database(os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'), os.environ.get('DB_HOST', '')),
 }
+DB_HEALTH_CHECKS = os.environ.get('DB_HEALTH_CHECKS', '1') == '1'
+
+# The "production" settings of SQLite, set on every connection when DB_SQLITE_PRODUCTION=1 (see home/db.py). Run
+# 'python manage.py sqlite_maintenance' every day or so with them
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB: 64 MiB
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+} if os.environ.get('DB_SQLITE_PRODUCTION') == '1' else {}
+
+# The aliases of the DATABASES the router may send reads to
+DATABASE_REPLICAS = []
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = database(
+        os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']), os.environ.get('DB_REPLICA_HOST', '')
+    )
+    DATABASE_REPLICAS = ['replica']
+elif TESTING:
+    # The tests have a replica, see home/tests/test_db.py (it is an empty test database, the tests copy rows to it)
+    DATABASES['replica'] = dict(DATABASES['default'])
+
+DATABASE_ROUTERS = ['home.db.ReplicaRouter']
+# After a user changes something, their pages read from the primary database for that many seconds, so that they see
+# their change even if the replica is late
+DATABASE_REPLICA_LAG = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Pick the backend with the CACHE_BACKEND environment variable:
+#  - 'file' (the default) keeps the cache in files under CACHE_DIR, it needs no server and is shared by all the processes
+#  - 'redis' uses the server at REDIS_URL, it needs 'pip install django-redis'
+#  - 'locmem' keeps the cache in the memory of each process, it is always used when running the tests
+
+CACHE_BACKEND = 'locmem' if TESTING else os.environ.get('CACHE_BACKEND', 'file')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', str(BASE_DIR / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How long the pages seen by logged-out visitors stay cached, see home/cache.py
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 5 * 60
+
+# Sessions
+# https://docs.djangoproject.com/en/3.2/topics/http/sessions/#configuring-the-session-engine
+# Pick where the sessions are kept with the SESSION_BACKEND environment variable:
+#  - 'cached_db' (the default) reads them from the cache, and only from the database when the cache lost them
+#  - 'db' reads and writes them in the database on every request
+#  - 'cache' keeps them in the cache only: a cache cleared or full logs the users out, use it with Redis
+#  - 'signed_cookies' keeps them in the cookie of the browser, signed with SECRET_KEY: nothing to store or clean up
+# Whatever the engine, a session is only saved when its data changed, see home/sessions. The tests use 'db', their
+# query counts include reading the session
+SESSION_BACKEND = 'db' if TESTING else os.environ.get('SESSION_BACKEND', 'cached_db')
+SESSION_ENGINE = 'home.sessions.%s' % SESSION_BACKEND
+# How often the job worker deletes the expired sessions, see home/tasks.py
+SESSION_CLEANUP_INTERVAL = 24 * 60 * 60
+
+# Count the poll votes in the cache and write them in batches, see polls/votes.py. Needs CACHE_BACKEND=redis
+POLLS_BUFFER_VOTES = os.environ.get('POLLS_BUFFER_VOTES') == '1'
+POLLS_VOTE_FLUSH_INTERVAL = 10
 
 
 # Password validation
@@ -144,6 +264,38 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Where the pictures of the ads are kept, see ads/storage.py
+ADS_PICTURE_STORAGE = 'ads.storage.FileSystemPictureStore'
+ADS_PICTURE_ROOT = BASE_DIR / 'media' / 'pictures'
+# The largest picture accepted. Uploads are written to the store as they arrive (see ads/uploads.py), so a larger
+# limit does not take more memory
+ADS_PICTURE_MAX_SIZE = 10 * 1024 * 1024
+
+# Request metrics, see home/metrics.py. The queries slower than METRICS_SLOW_QUERY_MS are logged, or a fraction of them
+METRICS_SLOW_QUERY_MS = 100
+METRICS_SLOW_QUERY_SAMPLE_RATE = 1.0
+# Who can read /metrics besides the staff: a client sending 'Authorization: Bearer <METRICS_TOKEN>' (e.g. Prometheus with
+# its 'authorization' option), or one of the addresses in METRICS_ALLOWED_IPS. The address is REMOTE_ADDR, which behind a
+# reverse proxy on the same machine (nginx, ...) is the proxy's for every visitor: never list 127.0.0.1 or ::1 there then
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = []
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'home.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 # Add the settings below
 
 REST_FRAMEWORK = {
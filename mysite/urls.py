@@ -24,6 +24,10 @@ from django.views.static import serve
 urlpatterns = [
     path('', include('home.urls')),  # Change to ads.urls
     path('ads/', include('ads.urls')),
+    path('polls/', include('polls.urls')),
+    path('autos/', include('autos.urls')),
+    path('cats/', include('cats.urls')),
+    path('hello/', include('hello.urls')),
     path('admin/', admin.site.urls),  # Keep
     path('accounts/', include('django.contrib.auth.urls')),  # Keep
     url(r'^oauth/', include('social_django.urls', namespace='social')),  # Keep
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.votes import flush_votes
+
+
+class Command(BaseCommand):
+    help = 'Write the votes buffered in the cache (POLLS_BUFFER_VOTES) to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep running, flushing every this many seconds (default: flush once and exit)')
+        parser.add_argument('--all', action='store_true', dest='all_choices',
+                            help='Look at the counters of every choice, not only the ones marked as having votes')
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = flush_votes(all_choices=options['all_choices'])
+            self.stdout.write(self.style.SUCCESS('Flushed %d votes' % flushed))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -9,6 +9,12 @@ class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
 
+    # The index page shows the latest questions: with the index the database reads them in order instead of sorting them all
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date'], name='polls_question_pub_date_idx'),
+        ]
+
     def __str__(self):
         return self.question_text
 
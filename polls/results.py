@@ -0,0 +1,85 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Sum, Window
+
+from .models import Choice, Question
+
+
+"""The results of a question, computed once and kept in the cache until the next vote, or the next flush of the buffered
+votes (see votes.py, which calls invalidate_results). A single query reads the choices, the text of the question
+(joined) and the total of the votes: SUM(votes) OVER () is a window function, it adds up the votes of all the rows
+without grouping them, so the percentages need no second query.
+More info: https://docs.djangoproject.com/en/3.2/ref/models/expressions/#window-functions
+
+The results are cached under the current version of the question, and invalidate_results() moves to the next version
+rather than deleting the results: a request that computed them just before a vote, but stores them just after, stores
+them under the old version, where no one looks anymore. A version starts from the time in milliseconds, so one evicted
+from the cache does not start again from a number whose results could still be cached. Old versions expire after
+RESULTS_TIMEOUT."""
+RESULTS_KEY = 'polls:results:%d:%d'
+VERSION_KEY = 'polls:results:version:%d'
+RESULTS_TIMEOUT = 24 * 60 * 60
+
+
+def get_results(question_id):
+    """The results of the question as a dict ready for JSON, or None if there is no such question."""
+    version = cache.get(VERSION_KEY % question_id)
+    if version is None:
+        version = _next_version(question_id)
+    key = RESULTS_KEY % (question_id, version)
+    results = cache.get(key)
+    if results is None:
+        results = compute_results(question_id)
+        if results is not None:
+            cache.set(key, results, RESULTS_TIMEOUT)
+    return results
+
+
+def compute_results(question_id):
+    rows = list(
+        Choice.objects.filter(question_id=question_id)
+        .annotate(total=Window(Sum('votes')))
+        .order_by('id')
+        .values('id', 'choice_text', 'votes', 'total', 'question__question_text')
+    )
+    if rows:
+        question_text, total = rows[0]['question__question_text'], rows[0]['total']
+    else:
+        # A question without choices
+        question_text = Question.objects.filter(id=question_id).values_list('question_text', flat=True).first()
+        if question_text is None:
+            return None
+        total = 0
+    return {
+        'question': question_id,
+        'question_text': question_text,
+        'total': total,
+        'choices': [
+            {
+                'id': row['id'],
+                'text': row['choice_text'],
+                'votes': row['votes'],
+                'percent': round(row['votes'] * 100 / total, 1) if total else 0,
+            }
+            for row in rows
+        ],
+    }
+
+
+def invalidate_results(question_ids):
+    for question_id in question_ids:
+        _next_version(question_id)
+
+
+def _next_version(question_id):
+    # The key can be evicted between add() and incr(), then we start over
+    key = VERSION_KEY % question_id
+    while True:
+        version = int(time.time() * 1000)
+        if cache.add(key, version, None):
+            return version
+        try:
+            return cache.incr(key)
+        except ValueError:
+            pass
@@ -0,0 +1,9 @@
+from jobs.queue import task
+
+from .votes import flush_votes
+
+
+# Queued by votes.record_vote when votes are buffered in the cache
+@task
+def flush_buffered_votes():
+    flush_votes()
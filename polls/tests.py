@@ -1,3 +1,304 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import run_pending
+
+from .models import Choice, Question
+from .results import compute_results, get_results
+from .votes import FLUSH_SCHEDULED_KEY, VOTE_KEY, flush_votes, pending_votes, record_vote
+
+
+def make_question(choices=2):
+    question = Question.objects.create(question_text='Best pet?', pub_date=timezone.now())
+    for i in range(choices):
+        question.choice_set.create(choice_text='choice %d' % i)
+    return question
+
+
+class VoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = make_question()
+        self.choice = self.question.choice_set.first()
+
+    def test_vote(self):
+        response = self.client.post(reverse('polls:vote', args=[self.question.id]), {'choice': self.choice.id})
+        self.assertRedirects(response, reverse('polls:results', args=[self.question.id]))
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 1)
+
+    def test_vote_is_one_update(self):
+        # question, update
+        with self.assertNumQueries(2):
+            self.client.post(reverse('polls:vote', args=[self.question.id]), {'choice': self.choice.id})
+
+    def test_invalid_choice(self):
+        other = make_question().choice_set.first()
+        for data in ({}, {'choice': 'abc'}, {'choice': other.id}):
+            response = self.client.post(reverse('polls:vote', args=[self.question.id]), data)
+            self.assertContains(response, 'select a choice')
+        self.assertEqual(sum(Choice.objects.values_list('votes', flat=True)), 0)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_buffered_votes(self):
+        for _ in range(3):
+            self.assertTrue(record_vote(self.question, self.choice.id))
+        self.assertFalse(record_vote(self.question, 0))
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 0)
+        self.assertEqual(pending_votes([self.choice.id]), {self.choice.id: 3})
+        # Only the first vote queues a flush
+        self.assertEqual(Job.objects.filter(name='polls.tasks.flush_buffered_votes').count(), 1)
+
+        self.assertEqual(flush_votes(), 3)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 3)
+        self.assertEqual(pending_votes([self.choice.id]), {})
+        self.assertEqual(flush_votes(), 0)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_buffered_vote_survives_an_eviction(self):
+        key = VOTE_KEY % self.choice.id
+        cache.set(key, 2)
+        incr = cache.incr
+
+        # The counter is evicted between add(), which finds it, and incr()
+        def evicted(*args, **kwargs):
+            cache.delete(key)
+            mocked.side_effect = incr
+            return incr(*args, **kwargs)
+
+        with mock.patch.object(cache, 'incr', side_effect=evicted) as mocked:
+            self.assertTrue(record_vote(self.question, self.choice.id))
+        self.assertEqual(pending_votes([self.choice.id]), {self.choice.id: 1})
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_flush_in_batches(self):
+        question = make_question(choices=7)
+        choices = list(question.choice_set.all())
+        for i, choice in enumerate(choices):
+            for _ in range(i + 1):
+                record_vote(question, choice.id)
+        # Only the 7 choices with votes are read (not the 2 of setUp): one update for each of the 2 batches
+        with self.assertNumQueries(2):
+            self.assertEqual(flush_votes(batch_size=4), 28)
+        self.assertEqual([choice.votes for choice in Choice.objects.filter(question=question)], list(range(1, 8)))
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_votes(), 0)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_flush_all_choices(self):
+        # A counter whose choice is not marked, e.g. the set was evicted from the cache
+        cache.set(VOTE_KEY % self.choice.id, 2)
+        self.assertEqual(flush_votes(), 0)
+        self.assertEqual(flush_votes(all_choices=True), 2)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 2)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_counter_evicted_during_a_flush(self):
+        choices = list(self.question.choice_set.order_by('id'))
+        for choice in choices:
+            record_vote(self.question, choice.id)
+            record_vote(self.question, choice.id)
+        decr = cache.decr
+
+        # The counter of the second choice is evicted after it was read
+        def evict_second(key, *args, **kwargs):
+            if key == VOTE_KEY % choices[1].id:
+                cache.delete(key)
+            return decr(key, *args, **kwargs)
+
+        with mock.patch.object(cache, 'decr', side_effect=evict_second):
+            self.assertEqual(flush_votes(), 4)
+        self.assertEqual(list(Choice.objects.filter(question=self.question).values_list('votes', flat=True)), [2, 2])
+        self.assertEqual(pending_votes([choice.id for choice in choices]), {})
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_failed_flush_gives_the_votes_back(self):
+        choices = list(self.question.choice_set.order_by('id'))
+        for choice in choices:
+            record_vote(self.question, choice.id)
+        with mock.patch.object(Choice.objects, 'filter', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                flush_votes()
+        self.assertEqual(pending_votes([choice.id for choice in choices]), {choices[0].id: 1, choices[1].id: 1})
+        self.assertEqual(flush_votes(), 2)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_votes_during_a_flush_are_kept(self):
+        record_vote(self.question, self.choice.id)
+        decr = cache.decr
+
+        # A vote comes in between the read of the counter and its decrement
+        def vote_then_decr(*args, **kwargs):
+            record_vote(self.question, self.choice.id)
+            return decr(*args, **kwargs)
+
+        with mock.patch.object(cache, 'decr', side_effect=vote_then_decr):
+            self.assertEqual(flush_votes(), 1)
+        self.assertEqual(flush_votes(), 1)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 2)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_flush_command_and_job(self):
+        record_vote(self.question, self.choice.id)
+        out = StringIO()
+        call_command('flush_votes', stdout=out)
+        self.assertIn('Flushed 1 votes', out.getvalue())
+
+        cache.clear()
+        record_vote(self.question, self.choice.id)
+        Job.objects.update(run_after=timezone.now())
+        run_pending()
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 2)
+
+
+class ResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = make_question(choices=3)
+        self.choices = list(self.question.choice_set.order_by('id'))
+
+    def test_results(self):
+        Choice.objects.filter(id=self.choices[0].id).update(votes=1)
+        Choice.objects.filter(id=self.choices[1].id).update(votes=2)
+        with self.assertNumQueries(1):
+            results = get_results(self.question.id)
+        self.assertEqual(results['question_text'], 'Best pet?')
+        self.assertEqual(results['total'], 3)
+        self.assertEqual([(c['votes'], c['percent']) for c in results['choices']], [(1, 33.3), (2, 66.7), (0, 0)])
+        # Cached
+        with self.assertNumQueries(0):
+            self.assertEqual(get_results(self.question.id), results)
+
+    def test_no_votes_and_no_choices(self):
+        self.assertEqual(get_results(self.question.id)['total'], 0)
+        empty = Question.objects.create(question_text='Nothing?', pub_date=timezone.now())
+        self.assertEqual(get_results(empty.id)['choices'], [])
+        self.assertIsNone(get_results(0))
+
+    def test_a_vote_refreshes_the_results(self):
+        get_results(self.question.id)
+        record_vote(self.question, self.choices[2].id)
+        self.assertEqual(get_results(self.question.id)['choices'][2]['votes'], 1)
+
+    def test_results_computed_before_a_vote_are_not_kept(self):
+        # A vote comes in after the results are computed but before they are cached
+        def compute_then_vote(question_id):
+            computed = compute_results(question_id)
+            record_vote(self.question, self.choices[0].id)
+            return computed
+
+        with mock.patch('polls.results.compute_results', side_effect=compute_then_vote):
+            self.assertEqual(get_results(self.question.id)['total'], 0)
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_a_flush_refreshes_the_results(self):
+        get_results(self.question.id)
+        record_vote(self.question, self.choices[2].id)
+        self.assertEqual(get_results(self.question.id)['total'], 0)
+        flush_votes()
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+
+    def test_results_page(self):
+        record_vote(self.question, self.choices[0].id)
+        response = self.client.get(reverse('polls:results', args=[self.question.id]))
+        self.assertContains(response, 'choice 0 -- 1 vote (100.0%)')
+        self.assertEqual(self.client.get(reverse('polls:results', args=[0])).status_code, 404)
+
+    def test_results_json(self):
+        url = reverse('polls:results_json', args=[self.question.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['total'], 0)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        record_vote(self.question, self.choices[0].id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total'], 1)
+        self.assertEqual(self.client.get(reverse('polls:results_json', args=[0])).status_code, 404)
+
+    def test_index_uses_the_index(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('polls:index'))
+        [sql] = [query['sql'] for query in context.captured_queries if 'polls_question' in query['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('polls_question_pub_date_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+def retry_if_locked(func):
+    while True:
+        try:
+            return func()
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+
+
+"""Many votes at the same time, from several threads, each with its own database connection. With the old
+read-modify-write some of them were lost. The in-memory test database answers "database table is locked" at once when
+another connection is writing, where a database file waits for it (busy_timeout): the statement did nothing, so the
+vote is just sent again."""
+@override_settings(METRICS_SLOW_QUERY_MS=10000)
+class ConcurrentVoteTests(TransactionTestCase):
+    THREADS = 8
+    VOTES = 2000
+
+    def setUp(self):
+        cache.clear()
+        self.question = make_question()
+        self.choice = self.question.choice_set.first()
+
+    def vote_concurrently(self, vote):
+        def votes(count):
+            try:
+                for _ in range(count):
+                    vote()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            list(pool.map(votes, [self.VOTES // self.THREADS] * self.THREADS))
+
+    def test_no_vote_is_lost(self):
+        url = reverse('polls:vote', args=[self.question.id])
+
+        def vote():
+            response = retry_if_locked(lambda: Client().post(url, {'choice': self.choice.id}))
+            self.assertEqual(response.status_code, 302)
+
+        self.vote_concurrently(vote)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, self.VOTES)
+
+    @override_settings(POLLS_BUFFER_VOTES=True)
+    def test_no_buffered_vote_is_lost(self):
+        # No flush job, the threads flush while the votes come in
+        cache.set(FLUSH_SCHEDULED_KEY, 1)
+
+        def vote():
+            retry_if_locked(lambda: record_vote(self.question, self.choice.id))
+            retry_if_locked(flush_votes)
+
+        self.vote_concurrently(vote)
+        flush_votes()
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, self.VOTES)
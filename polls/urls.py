@@ -8,5 +8,6 @@ urlpatterns = [
     path('owner', views.owner, name='owner'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results.json', views.results_json, name='results_json'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
     ]
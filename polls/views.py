@@ -1,9 +1,12 @@
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
 from django.views import generic
 
-from .models import Choice, Question
+from .models import Question
+from .results import get_results
+from .votes import record_vote
 
 
 class IndexView(generic.ListView):
@@ -19,27 +22,45 @@ class DetailView(generic.DetailView):
     template_name = 'polls/detail.html'
 
 
-class ResultsView(generic.DetailView):
-    model = Question
+# The results come from the snapshot kept in the cache, see results.py
+class ResultsView(generic.View):
     template_name = 'polls/results.html'
 
+    def get(self, request, pk):
+        results = get_results(pk)
+        if results is None:
+            raise Http404('No such question')
+        return render(request, self.template_name, {'results': results})
+
+
+# The same results as JSON, for the widgets that refresh them. A widget asking again with If-None-Match gets an empty
+# '304 Not Modified' until a vote changes them
+def results_json(request, pk):
+    results = get_results(pk)
+    if results is None:
+        raise Http404('No such question')
+    response = JsonResponse(results)
+    set_response_etag(response)
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
 
+# The vote is counted with a single UPDATE, or in the cache when POLLS_BUFFER_VOTES is on, see votes.py
 def vote(request, question_id):
     question = get_object_or_404(Question, pk=question_id)
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        counted = record_vote(question, request.POST['choice'])
+    except (KeyError, ValueError):
+        counted = False
+    if not counted:
         # Redisplay the question voting form.
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
-    else:
-        selected_choice.votes += 1
-        selected_choice.save()
-        # Always return an HttpResponseRedirect after successfully dealing
-        # with POST data. This prevents data from being posted twice if a
-        # user hits the Back button.
+    # Always return an HttpResponseRedirect after successfully dealing
+    # with POST data. This prevents data from being posted twice if a
+    # user hits the Back button.
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
@@ -0,0 +1,149 @@
+import datetime
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When
+
+from jobs.queue import enqueue
+
+from .models import Choice
+from .results import invalidate_results
+
+
+"""Counting the votes. A vote used to load the choice, add one in Python and save the row back: two votes at the same time
+both read 10 and both write 11, one of them is lost. Now a vote is a single UPDATE ... SET votes = votes + 1 (an F()
+expression), which the database applies atomically, and only touches the votes column.
+More info: https://docs.djangoproject.com/en/3.2/ref/models/expressions/#avoiding-race-conditions-using-f
+
+On a very busy poll every vote still waits for the lock on the same row (on SQLite, for the whole database). With
+POLLS_BUFFER_VOTES the votes are instead counted in the cache (cache.incr, atomic on Redis) and written to the database in
+batches by flush_votes(): by the job worker (see tasks.py), POLLS_VOTE_FLUSH_INTERVAL seconds after the first buffered
+vote, or by 'python manage.py flush_votes'. The results lag behind by that much. The cache must be shared by all the
+processes and have an atomic incr(), so use CACHE_BACKEND=redis: with the file cache two votes at the same time can
+still count as one.
+The first vote of a choice since the last flush adds it to a set of "dirty" choices kept in the cache, so a flush only
+reads the counters of those choices however many choices there are. The flushes take a lock (cache.add() only sets a
+missing key, atomically), so two of them at the same time cannot both write the same votes."""
+VOTE_KEY = 'polls:votes:%d'
+FLUSH_SCHEDULED_KEY = 'polls:votes:flush_scheduled'
+# The (choice id, question id) pairs with buffered votes
+DIRTY_KEY = 'polls:votes:dirty'
+LOCK_KEY = 'polls:votes:lock:%s'
+# A lock held longer than this is given up (e.g. the process holding it died)
+LOCK_TIMEOUT = 60
+
+
+def record_vote(question, choice_id):
+    """Count a vote for choice_id, return False if it is not a choice of question."""
+    choices = Choice.objects.filter(id=choice_id, question=question)
+    if not settings.POLLS_BUFFER_VOTES:
+        if not choices.update(votes=F('votes') + 1):
+            return False
+        invalidate_results([question.id])
+        return True
+    if not choices.exists():
+        return False
+    if _increment(VOTE_KEY % int(choice_id)) == 1:
+        _mark_dirty([(int(choice_id), question.id)])
+    _schedule_flush()
+    return True
+
+
+def _increment(key, delta=1):
+    # incr() raises ValueError on a missing key: add() creates it with the votes, else the votes go to incr(). The key can
+    # still be evicted between the two calls (the cache is full), then we start over
+    while not cache.add(key, delta, None):
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            pass
+    return delta
+
+
+@contextmanager
+def _lock(name):
+    key = LOCK_KEY % name
+    while not cache.add(key, 1, LOCK_TIMEOUT):
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def _mark_dirty(pairs):
+    with _lock('dirty'):
+        cache.set(DIRTY_KEY, cache.get(DIRTY_KEY, set()) | set(pairs), None)
+
+
+def _take_dirty():
+    with _lock('dirty'):
+        dirty = cache.get(DIRTY_KEY, set())
+        cache.delete(DIRTY_KEY)
+    return dirty
+
+
+def _schedule_flush():
+    # Only the first vote of a batch queues the job, the key keeps the others from queueing more
+    interval = settings.POLLS_VOTE_FLUSH_INTERVAL
+    if cache.add(FLUSH_SCHEDULED_KEY, 1, interval):
+        from .tasks import flush_buffered_votes  # tasks.py imports this module
+        enqueue(flush_buffered_votes, delay=datetime.timedelta(seconds=interval))
+
+
+def pending_votes(choice_ids):
+    """The buffered votes not written yet, {choice id: votes}."""
+    pending = cache.get_many([VOTE_KEY % choice_id for choice_id in choice_ids])
+    return {int(key.rsplit(':', 1)[1]): count for key, count in pending.items() if count}
+
+
+def flush_votes(batch_size=500, all_choices=False):
+    """Write the buffered votes to the database and return how many there were. Each batch of dirty choices is updated by
+    a single UPDATE ... SET votes = votes + CASE id WHEN ... END. The counters in the cache are decreased by what was read
+    rather than reset, so the votes that come in meanwhile are kept (and their choice marked again) for the next flush.
+    all_choices also looks at the choices that are not marked, in case the set was evicted from the cache."""
+    flushed = 0
+    with _lock('flush'):
+        dirty = sorted(_take_dirty())
+        if all_choices:
+            dirty = sorted(set(dirty) | set(Choice.objects.values_list('id', 'question_id')))
+        for start in range(0, len(dirty), batch_size):
+            try:
+                flushed += _flush_batch(dict(dirty[start:start + batch_size]))
+            except Exception:
+                # The next flush will try again
+                _mark_dirty(dirty[start:])
+                raise
+    return flushed
+
+
+def _flush_batch(questions):
+    pending = pending_votes(questions)
+    if not pending:
+        return 0
+    taken, left = {}, []
+    try:
+        for choice_id, count in pending.items():
+            try:
+                remaining = cache.decr(VOTE_KEY % choice_id, count)
+            except ValueError:
+                # Evicted since it was read: the votes read are still written, the next vote starts a new counter
+                remaining = 0
+            taken[choice_id] = count
+            if remaining > 0:
+                left.append(choice_id)
+        Choice.objects.filter(id__in=pending).update(votes=F('votes') + Case(
+            *(When(id=choice_id, then=Value(count)) for choice_id, count in pending.items()),
+            default=Value(0), output_field=IntegerField(),
+        ))
+    except Exception:
+        # Give the votes taken so far back to the cache
+        for choice_id, count in taken.items():
+            _increment(VOTE_KEY % choice_id, count)
+        raise
+    if left:
+        _mark_dirty((choice_id, questions[choice_id]) for choice_id in left)
+    invalidate_results({questions[choice_id] for choice_id in pending})
+    return sum(pending.values())